@@ -1 +1,37 @@
-from .database import Note
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+        Stands in for a module until one of its attributes is used, then imports it. Unlike importlib.util.LazyLoader (before Python 3.12),
+        the first use can come from several threads at once: the import system makes the other threads wait until the module has loaded.
+    """
+    def __getattr__(self, attribute):
+        module = self.__dict__.get('_module')
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return getattr(module, attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(importlib.import_module(self.__name__), attribute, value)
+
+
+def lazy_import(name):
+    """
+        Returns the module name, which is only actually imported the first time one of its attributes is used. This keeps the startup of
+        manage.py fast, since most commands only need a few of the modules (and peewee and numpy are slow to import).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def __getattr__(name):
+    #the database (and peewee) is only loaded when a model is asked for
+    if name == 'Note':
+        from .database import Note
+        return Note
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,4 +1,4 @@
-from . import  Note
+from .database import Note
 
 import numpy as np
 
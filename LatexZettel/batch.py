@@ -0,0 +1,195 @@
+"""
+    Batch rendering: many notes are combined into one generated document, which is compiled (and run through biber) once and then split
+    back into a pdf and an aux file per note. This saves loading the class, the bibliography and the cross reference data once per note.
+
+    In the combined document each note starts on a new page, in a refsection of its own, with its counters reset. The labels of a note are
+    prefixed with its reference (eq1 in NoteName becomes NoteName-eq1, the name \\excref already uses). Notes in other batches are found
+    through copies of the aux files of those batches, taken between passes. The first page of each note is written to the aux file as
+    \\texnotesstart{reference}{page}, and the number of pages as \\texnotespages{n}.
+
+    The batch is split into a pdf per note, so \\excref and \\exhyperref are redefined to link to filename.pdf#anchor, the same remote link
+    a note rendered on its own gets from xr-hyper, whether the target is in the same batch, another batch or rendered on its own. The split
+    pdfs keep the named destinations of the batch (see split_pdf) so that these links, and those of notes rendered on their own, resolve.
+
+    Only pdf output is supported. A note with its own preamble (anything besides \\documentclass and \\title) can't be combined and is
+    rendered on its own.
+"""
+import os
+import re
+import shutil
+
+from . import profiling
+
+
+#command for extracting pages of a pdf, see split_pdf. The batch is the primary input rather than --empty, so that its document level
+#name dictionary, holding the destinations the links to the note point at, is kept
+SPLIT_COMMAND = ['qpdf', '{input}', '--pages', '.', '{pages}', '--', '{output}']
+
+REFERENCE_COMMANDS = re.compile(r'\\(label|ref|eqref|pageref|cref|Cref|crefrange|Crefrange|cpageref|Cpageref|autoref|nameref|currentdoc)(\*?)\{([^}]*)\}')
+HYPERREF = re.compile(r'\\hyperref\[([^]]*)\]')
+TITLE = re.compile(r'\\title\{')
+NEWLABEL = re.compile(r'^\\newlabel\{(.*?)\}(.*)$', re.M)
+START = re.compile(r'^\\texnotesstart\{(.*?)\}\{(\d+)\}', re.M)
+PAGES = re.compile(r'^\\texnotespages\{(\d+)\}', re.M)
+
+PREAMBLE = r"""\def\texnotesbatch{}
+\documentclass{../template/texnote}
+\makeatletter
+\hypersetup{hypertexnames=false}
+\newcommand\texnotesstart[2]{}
+\newcommand\texnotespages[1]{}
+\newcount\texnotes@pages
+\AddToHook{shipout/before}{\global\advance\texnotes@pages by 1}
+\newcommand\texnotesmark[1]{\protected@write\@auxout{}{\string\texnotesstart{#1}{\the\texnotes@pages}}}
+\AtEndDocument{\clearpage\immediate\write\@auxout{\string\texnotespages{\the\texnotes@pages}}}
+\newcommand\texnotesfile[2]{\expandafter\def\csname texnotes@file@#1\endcsname{#2}}
+\newcommand\texnotes@link[3]{%
+    \ifcsname texnotes@file@#1\endcsname
+        \edef\texnotes@target{\csname texnotes@file@#1\endcsname.pdf}%
+        \edef\texnotes@anchor{\getrefbykeydefault{#1-#2}{anchor}{}}%
+        \hyper@@link{\texnotes@target}{\texnotes@anchor}{#3}%
+    \else
+        \hyperref[#1-#2]{#3}%
+    \fi
+}
+\renewcommand{\excref}[2][note]{\ifthenelse{\equal{#1}{note}}{\texnotes@link{#2}{#1}{\texttt{#2}}}{\texnotes@link{#2}{#1}{\texttt{#2/}\cref*{#2-#1}}}}
+\renewcommand{\exhyperref}[3][note]{\texnotes@link{#2}{#1}{#3}}
+\let\texnotes@maketitle\maketitle
+\let\texnotes@title\title
+\newcommand\texnotesnote{%
+    \clearpage
+    \let\maketitle\texnotes@maketitle
+    \let\title\texnotes@title
+    \setcounter{page}{1}\setcounter{section}{0}\setcounter{equation}{0}\setcounter{definition}{0}%
+    \setcounter{figure}{0}\setcounter{table}{0}\setcounter{footnote}{0}%
+}
+\makeatother
+"""
+
+
+def prefix_labels(text, reference):
+    """
+        Prefixes the labels defined and referred to in the note with its reference. Links to other notes (\\excref) already use the prefixed names.
+    """
+    def prefix(names):
+        return ','.join(f'{reference}-{name.strip()}' for name in names.split(','))
+
+    text = REFERENCE_COMMANDS.sub(lambda m: f'\\{m.group(1)}{m.group(2)}{{{prefix(m.group(3))}}}', text)
+    return HYPERREF.sub(lambda m: f'\\hyperref[{prefix(m.group(1))}]', text)
+
+
+def split_note(contents):
+    """
+        Returns (title, body) of a note, or None if the preamble of the note has anything besides \\documentclass and \\title.
+    """
+    document = contents.split('\\end{document}')[0]
+    if '\\begin{document}' not in document:
+        return None
+    preamble, body = document.split('\\begin{document}', 1)
+
+    title = ''
+    match = TITLE.search(preamble)
+    if match is not None:
+        #the title ends at the brace matching \title{
+        depth = 1
+        for i in range(match.end(), len(preamble)):
+            depth += {'{': 1, '}': -1}.get(preamble[i], 0)
+            if depth == 0:
+                title = preamble[match.end():i]
+                preamble = preamble[:match.start()] + preamble[i + 1:]
+                break
+
+    for line in preamble.splitlines():
+        line = re.sub(r'(?<!\\)%.*', '', line).strip()
+        if line != '' and not line.startswith('\\documentclass'):
+            return None
+    return title, body
+
+
+def frozen(name):
+    """
+        Name of the copy of the aux file of a batch that the other batches read, see freeze_aux.
+    """
+    return f'frozen-{name}'
+
+
+def freeze_aux(names, cwd):
+    """
+        Copies the aux file of each batch to frozen(name).aux. The batches are compiled in parallel and pdflatex truncates its aux file when
+        it starts, so the other batches read these copies, taken between passes, instead.
+    """
+    for name in names:
+        aux = os.path.join(cwd, f'{name}.aux')
+        if os.path.exists(aux):
+            shutil.copyfile(aux, os.path.join(cwd, f'{frozen(name)}.aux'))
+
+
+def master_document(notes, externals=(), documents=(), filenames=None):
+    """
+        The combined document for notes, a list of (reference, title, body, referrers) where referrers are the references of the notes
+        listed in its Referenced In section. externals are the jobnames of the other batches, whose frozen aux files are read, and documents
+        the (reference, filename) of the notes rendered on their own, whose aux files are found in the output folder as in documents.tex.
+        filenames is {reference: filename} for every note, giving the pdfs that links to other notes point at.
+    """
+    parts = [PREAMBLE]
+    for reference, filename in sorted((filenames or {}).items()):
+        parts.append(f'\\texnotesfile{{{reference}}}{{{filename}}}\n')
+    for external in externals:
+        parts.append(f'\\externaldocument{{{frozen(external)}}}\n')
+    for reference, filename in documents:
+        parts.append(f'\\externaldocument[{reference}-]{{{filename}}}\n')
+    parts.append('\\begin{document}\n')
+
+    for reference, title, body, referrers in notes:
+        parts.append(f'\\texnotesnote\\texnotesmark{{{reference}}}\n\\title{{{title}}}\n\\begin{{refsection}}\n')
+        parts.append(prefix_labels(body, reference))
+        if len(referrers) > 0:
+            parts.append('\n\\section*{Referenced In}\n\\begin{itemize}\n')
+            parts.extend(f'\\item \\excref{{{r}}}\n' for r in referrers)
+            parts.append('\\end{itemize}\n')
+        parts.append('\n\\end{refsection}\n')
+
+    parts.append('\\end{document}\n')
+    return ''.join(parts)
+
+
+def read_aux(path):
+    """
+        Returns ({reference: first page}, number of pages, {reference: [\\newlabel lines with the prefix removed]}) from the aux file of a batch.
+    """
+    with open(path, 'r', errors='replace') as f:
+        text = f.read()
+
+    starts = {reference: int(page) for reference, page in START.findall(text)}
+    pages = PAGES.findall(text)
+    labels = {}
+    for name, rest in NEWLABEL.findall(text):
+        #references can contain -, so try each split
+        for i in [i for i, c in enumerate(name) if c == '-']:
+            if name[:i] in starts:
+                labels.setdefault(name[:i], []).append(f'\\newlabel{{{name[i + 1:]}}}{rest}')
+                break
+    return starts, int(pages[-1]) if len(pages) > 0 else None, labels
+
+
+def page_ranges(starts, pages):
+    """
+        {reference: (first, last)} from the first pages of the notes and the total number of pages.
+    """
+    ordered = sorted(starts.items(), key=lambda s: s[1])
+    ranges = {}
+    for i, (reference, first) in enumerate(ordered):
+        last = ordered[i + 1][1] - 1 if i + 1 < len(ordered) else pages
+        ranges[reference] = (first, max(first, last))
+    return ranges
+
+
+def split_pdf(pdf, first, last, output, cwd=None):
+    """
+        Writes the pages first to last of pdf to output. Returns None if the split command isn't installed.
+    """
+    command = [c.format(input=pdf, output=output, pages=f'{first}-{last}') for c in SPLIT_COMMAND]
+    try:
+        return profiling.run(command, cwd=cwd, capture_output=True)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,137 @@
+"""
+    Index of the entries of bibliography.bib (BibEntry), with a hash of each entry so that a change to the bibliography only causes biber to
+    be run for the notes citing the entries that changed. The notes are kept in the PendingBiber table until they have been rendered with biber,
+    so that the change isn't lost if the bibliography is indexed by a command that doesn't render.
+"""
+import hashlib
+import os
+import re
+
+from peewee import JOIN
+
+from . import database
+
+
+BIBLIOGRAPHY = 'bibliography.bib'
+
+FORMATS = ['pdf', 'html']
+
+ENTRY = re.compile(r'@\s*(\w+)\s*([{(])')
+
+
+def parse(text):
+    """
+        Returns ({key: text of the entry}, text of the @string and @preamble blocks) for a BibTeX file.
+    """
+    entries = {}
+    shared = []
+    position = 0
+    while True:
+        match = ENTRY.search(text, position)
+        if match is None:
+            break
+        kind = match.group(1).lower()
+        close = '}' if match.group(2) == '{' else ')'
+
+        #the entry ends at the bracket matching the opening one
+        depth = 1
+        end = match.end()
+        while end < len(text) and depth > 0:
+            if text[end] == match.group(2):
+                depth += 1
+            elif text[end] == close:
+                depth -= 1
+            end += 1
+        block = text[match.start():end]
+        position = end
+
+        if kind == 'comment':
+            continue
+        elif kind in ('string', 'preamble'):
+            shared.append(block)
+            continue
+
+        key = text[match.end():end].split(',', 1)[0].strip()
+        if key != '':
+            entries[key] = block
+    return entries, '\n'.join(shared)
+
+
+def entry_hash(entry, shared):
+    #an entry can use any @string macro, so a change to them changes every entry
+    return hashlib.sha1((shared + '\n' + re.sub(r'\s+', ' ', entry)).encode()).hexdigest()
+
+
+def update_index(path=BIBLIOGRAPHY):
+    """
+        Brings the BibEntry table up to date with the bibliography, if it has been modified since it was last indexed, and marks the notes
+        citing the entries that were added, changed or removed as needing biber in every format. Returns the keys of those entries.
+    """
+    BibEntry = database.BibEntry
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return set()
+
+    signature = f'{stat.st_mtime}:{stat.st_size}'
+    if database.get_setting('bibliography_signature') == signature:
+        return set()
+
+    with open(path, 'r', errors='replace') as f:
+        entries, shared = parse(f.read())
+    hashes = {key: entry_hash(entry, shared) for key, entry in entries.items()}
+
+    indexed = {entry.key: entry.content_hash for entry in BibEntry.select(BibEntry.key, BibEntry.content_hash)}
+    changed = set(key for key in set(hashes) | set(indexed) if hashes.get(key) != indexed.get(key))
+
+    with database.database.atomic():
+        removed = [key for key in changed if key not in hashes]
+        for i in range(0, len(removed), 500):
+            BibEntry.delete().where(BibEntry.key.in_(removed[i:i + 500])).execute()
+        rows = [(key, hashes[key]) for key in changed if key in hashes]
+        for i in range(0, len(rows), 500):
+            BibEntry.replace_many(rows[i:i + 500], fields=[BibEntry.key, BibEntry.content_hash]).execute()
+        pending = [(note.id, format) for note in notes_citing(changed) for format in FORMATS]
+        for i in range(0, len(pending), 500):
+            database.PendingBiber.insert_many(pending[i:i + 500], fields=[database.PendingBiber.note, database.PendingBiber.format]).on_conflict_ignore().execute()
+        database.set_setting('bibliography_signature', signature)
+
+    return changed
+
+
+def notes_citing(keys):
+    """
+        The notes citing any of the keys.
+    """
+    keys = list(keys)
+    if len(keys) == 0:
+        return []
+    Citation = database.Citation
+    notes = set()
+    for i in range(0, len(keys), 500):
+        notes.update(database.Note.select().join(Citation).where(Citation.citationkey.in_(keys[i:i + 500])).distinct())
+    return sorted(notes, key=lambda note: note.filename)
+
+
+def pending(format):
+    """
+        The notes that need biber the next time they are rendered in format, because an entry they cite has changed.
+    """
+    return list(database.Note.select().join(database.PendingBiber).where(database.PendingBiber.format == format))
+
+
+def clear_pending(note, format):
+    database.PendingBiber.delete().where(database.PendingBiber.note == note, database.PendingBiber.format == format).execute()
+
+
+def unused_entries():
+    """
+        Keys of the entries of the bibliography that no note cites.
+    """
+    BibEntry, Citation = database.BibEntry, database.Citation
+    query = (BibEntry
+             .select(BibEntry.key)
+             .join(Citation, JOIN.LEFT_OUTER, on=(Citation.citationkey == BibEntry.key))
+             .where(Citation.id.is_null())
+             .order_by(BibEntry.key))
+    return [key for key, in query.tuples()]
@@ -0,0 +1,115 @@
+"""
+    Builds notes in a directory of their own outside the slipbox, so that the intermediate files of pdflatex and make4ht are never written
+    to pdf/ and html/, half written output is never visible there, and any number of notes can be built at once.
+
+    The build root is the folder given by the environment variable TEXNOTES_BUILD_ROOT (eg /dev/shm/texnotes), or the system temporary
+    folder. Each job gets a folder root/<note>-xxxx/ containing links to the template, notes, config and resources folders and the
+    bibliography of the slipbox, so that the relative paths used by the template (../template, ../notes, ...) resolve as they do from pdf/,
+    and a work/ folder the renderer runs in. Where links can't be created (Windows without developer mode) the folders are copied instead,
+    which is slower. The aux files of other notes are found through TEXINPUTS.
+"""
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+
+
+LINKS = ['template', 'notes', 'config', 'resources', 'bibliography.bib']
+
+#files copied back into the output folder after a build. The aux and bbl files are needed by the next build of the note and by the notes linking to it
+ARTIFACTS = {
+    'pdf': ['.pdf', '.aux', '.bbl', '.synctex.gz'],
+    'html': ['.html', '.css', '.svg', '.png', '.aux', '.bbl'],
+}
+
+#files of the previous build that are copied into a new job, so that a single pass resolves the references within the note
+SEED = ['.aux', '.bbl']
+
+
+def build_root():
+    root = os.environ.get('TEXNOTES_BUILD_ROOT') or tempfile.gettempdir()
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+@contextmanager
+def job_directory(filename, format):
+    """
+        Creates the build folder for rendering the note in the format, and removes it afterwards. Yields the absolute path of the folder to run the renderer in.
+    """
+    slipbox = os.getcwd()
+    job = tempfile.mkdtemp(prefix=f'{os.path.basename(filename)}-', dir=build_root())
+    try:
+        for name in LINKS:
+            if os.path.exists(os.path.join(slipbox, name)):
+                link(os.path.join(slipbox, name), os.path.join(job, name))
+
+        work = os.path.join(job, 'work')
+        os.mkdir(work)
+        for extension in SEED:
+            previous = os.path.join(slipbox, format, f'{filename}{extension}')
+            if os.path.exists(previous):
+                shutil.copyfile(previous, os.path.join(work, f'{filename}{extension}'))
+
+        yield work
+    finally:
+        shutil.rmtree(job, ignore_errors=True)
+
+
+def link(source, destination):
+    """
+        Links destination to source, or copies source if symbolic links can't be created (on Windows without developer mode or admin rights).
+    """
+    try:
+        os.symlink(source, destination, target_is_directory=os.path.isdir(source))
+    except OSError:
+        if os.path.isdir(source):
+            shutil.copytree(source, destination)
+        else:
+            shutil.copyfile(source, destination)
+
+
+def environment(format):
+    """
+        Environment for the renderer, with the output folder on TEXINPUTS so that \\externaldocument finds the aux files of the other notes.
+    """
+    env = dict(os.environ)
+    output = os.path.abspath(format)
+    #the trailing separator keeps the default search path
+    env['TEXINPUTS'] = output + os.pathsep + env.get('TEXINPUTS', '')
+    if not env['TEXINPUTS'].endswith(os.pathsep):
+        env['TEXINPUTS'] += os.pathsep
+    return env
+
+
+def publish_file(source, folder):
+    """
+        Moves the file into folder with a rename, so that readers of folder see either the old file or the new one. The file is copied next
+        to its destination first when the build root is on another file system.
+    """
+    destination = os.path.join(folder, os.path.basename(source))
+    try:
+        os.replace(source, destination)
+    except OSError:
+        handle, temporary = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+        os.close(handle)
+        try:
+            shutil.copyfile(source, temporary)
+            os.replace(temporary, destination)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+def publish(work, filename, format):
+    """
+        Publishes the artifacts of a successful build in work into the output folder, with the document itself last. Nothing is published for a
+        failed build, whose output is in logs/format/filename.log, so the previous output stays in place.
+    """
+    #the document (.pdf or .html) last, so that the aux files are in place when it appears
+    extensions = sorted(ARTIFACTS[format], key=lambda e: e == f'.{format}')
+    names = sorted(os.listdir(work))
+    for extension in extensions:
+        for name in names:
+            if name.endswith(extension):
+                publish_file(os.path.join(work, name), format)
@@ -0,0 +1,68 @@
+import json
+import os
+import re
+
+from . import profiling
+
+
+PANDOC_OPTIONS = ['-s', '-t', 'latex', '--lua-filter=pandoc/filter.lua', '--template=pandoc/template.tex', '--metadata-file=pandoc/defaults.yaml', '--biblatex']
+
+
+def convert_markdown(title, output, text):
+    """
+        Converts a single markdown note to LaTeX with its own pandoc process. Returns the completed process.
+    """
+    options = ['-o', output] + PANDOC_OPTIONS + ['-M', f'title={title}']
+    return profiling.run(['pandoc', *options], input=text.encode(), capture_output=True)
+
+
+def convert_markdown_batch(jobs):
+    """
+        Converts a list of (title, output, text) markdown notes to LaTeX in a single pandoc process (see pandoc/batch.lua).
+        Any note that fails, or all of them if the batch can't be run (eg pandoc < 3.1 has no lua interpreter), is converted on its own.
+        Returns a dict {output: error message or None}.
+    """
+    if len(jobs) == 0:
+        return {}
+
+    results = {}
+    payload = json.dumps([{'title': title, 'output': output, 'text': text} for title, output, text in jobs])
+    try:
+        process = profiling.run(['pandoc', 'lua', os.path.join('pandoc', 'batch.lua')], input=payload.encode(), capture_output=True)
+        outputs = set(output for title, output, text in jobs)
+        for line in process.stdout.decode(errors='replace').splitlines():
+            fields = line.split('\t')
+            if len(fields) >= 2 and fields[0] == 'ok' and fields[1] in outputs:
+                results[fields[1]] = None
+    except FileNotFoundError:
+        pass
+
+    for title, output, text in jobs:
+        if output in results:
+            continue
+        process = convert_markdown(title, output, text)
+        results[output] = None if process.returncode == 0 else process.stderr.decode()
+
+    return results
+
+
+def convert_latex(text, output, resolve=None):
+    """
+        Converts a LaTeX note to markdown, with \\excref and \\exhyperref converted to wikilinks. The links are swapped for placeholder words while
+        pandoc runs so that the brackets aren't escaped. Returns the completed process.
+    """
+    from . import wikilinks
+
+    links = []
+    def placeholder(m):
+        links.append(wikilinks.latex_link_to_wikilink(m, resolve))
+        return f'texnoteslink{len(links) - 1}x'
+
+    text = wikilinks.LATEX_LINK.sub(placeholder, text)
+    process = profiling.run(['pandoc', '-f', 'latex', '-t', 'markdown'], input=text.encode(), capture_output=True)
+    if process.returncode == 0:
+        markdown = re.sub(r'texnoteslink(\d+)x', lambda m: links[int(m.group(1))], process.stdout.decode())
+        with open(output, 'w') as f:
+            f.write(markdown)
+
+    return process
@@ -1,4 +1,5 @@
 import peewee as pw
+from playhouse.sqlite_ext import FTS5Model, SearchField, RowIDField
 
 
 database = pw.SqliteDatabase('slipbox.db', pragmas={'foreign_keys': 1})
@@ -12,16 +13,43 @@ class Note(BaseModel):
     reference = pw.CharField(unique=True) #\externaldocument reference for the note, default value for example_note.tex would be ExampleNote.
     last_build_date_html = pw.DateTimeField(null=True)
     last_build_date_pdf = pw.DateTimeField(null=True)
-    last_edit_date = pw.DateTimeField(null=True)
+    last_edit_date = pw.DateTimeField(null=True, index=True)
     created = pw.DateTimeField(null=True)
 
 
+class Setting(BaseModel):
+    """
+        Key value store for the state of the slipbox, eg the time of the last synchronize.
+    """
+    key = pw.CharField(unique=True)
+    value = pw.TextField()
+
+
 class Citation(BaseModel):
     """
         Model to keep track of which notes reference papers.
     """
     note = pw.ForeignKeyField(Note, on_delete='CASCADE', backref='citations')
-    citationkey = pw.CharField()
+    citationkey = pw.CharField(index=True)
+
+
+class BibEntry(BaseModel):
+    """
+        An entry of bibliography.bib, with a hash of its contents (and of the @string macros it could use).
+    """
+    key = pw.CharField(unique=True)
+    content_hash = pw.CharField()
+
+
+class PendingBiber(BaseModel):
+    """
+        A note citing an entry of bibliography.bib that has changed since the note was last rendered with biber in format.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', backref='pending_biber')
+    format = pw.CharField()
+
+    class Meta:
+        indexes = ((('note', 'format'), True),)
 
 
 class Label(BaseModel):
@@ -39,14 +67,149 @@ class Link(BaseModel):
 
 class Tag(BaseModel):
     name = pw.CharField(unique=True)
-    notes = pw.ManyToManyField(Note)
+    #on_delete only applies to new databases, see Helper.remove_note
+    notes = pw.ManyToManyField(Note, on_delete='CASCADE')
 
 NoteTag = Tag.notes.get_through_model()
 
+
+class Term(BaseModel):
+    """
+        Vocabulary of words appearing in the bodies of the notes, used for content similarity.
+    """
+    text = pw.CharField(unique=True)
+
+
+class NoteVector(BaseModel):
+    """
+        Term frequency vector of the body of a note. term_ids and counts are packed arrays of int32.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', unique=True, backref='vector')
+    term_ids = pw.BlobField()
+    counts = pw.BlobField()
+
+class NotePosition(BaseModel):
+    """
+        Position of a note in the network view, so that the layout doesn't need to be recalculated each time the view is opened.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', unique=True, backref='position')
+    x = pw.FloatField()
+    y = pw.FloatField()
+
+
+class MarkdownConversion(BaseModel):
+    """
+        Hash of the (link resolved) markdown that was last converted to each slipbox note by sync_md.
+    """
+    filename = pw.CharField(unique=True)
+    source_hash = pw.CharField()
+
+
+class BlockIndex(BaseModel):
+    """
+        Byte ranges of the %<*tag> ... %</tag> blocks in a file, stored as json {tag: [start, end]}, valid while the file has hash content_hash.
+    """
+    path = pw.CharField(unique=True)
+    content_hash = pw.CharField()
+    blocks = pw.TextField()
+
+
+class Project(BaseModel):
+    """
+        A project file that has been exported by Helper.export_project
+    """
+    name = pw.CharField()
+    texfile = pw.CharField()
+    source_hash = pw.CharField(null=True)
+    last_export = pw.DateTimeField(null=True)
+    last_build_date_pdf = pw.DateTimeField(null=True)
+
+    class Meta:
+        indexes = ((('name', 'texfile'), True),)
+
+
+class ProjectDependency(BaseModel):
+    """
+        A block transcluded into a project, with the hash of the block when the project was last exported.
+    """
+    project = pw.ForeignKeyField(Project, on_delete='CASCADE', backref='dependencies')
+    path = pw.CharField()
+    tag = pw.CharField()
+    block_hash = pw.CharField()
+
+
+class RenderRun(BaseModel):
+    """
+        History of renders of the notes: how long they took, how many passes, whether biber was run and the exit code.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', backref='renders')
+    format = pw.CharField()
+    started = pw.DateTimeField(index=True)
+    duration = pw.FloatField()
+    passes = pw.IntegerField(default=1)
+    biber = pw.BooleanField(default=False)
+    returncode = pw.IntegerField()
+
+
+class RenderJob(BaseModel):
+    """
+        A render of one pass of a note by Helper.render_all, kept so that an interrupted run can be continued by Helper.render_resume. state is
+        queued, running, done or failed, and a failed render is queued again with not_before set until it has used its attempts.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', backref='render_jobs')
+    format = pw.CharField()
+    render_pass = pw.IntegerField()
+    priority = pw.IntegerField(default=0)
+    state = pw.CharField(default='queued', index=True)
+    attempts = pw.IntegerField(default=0)
+    not_before = pw.DateTimeField(null=True)
+    claimed = pw.DateTimeField(null=True)
+
+
+class BuildLabels(BaseModel):
+    """
+        The \\newlabel entries written to the aux file of a note the last time it was rendered in a format, as json {label: [number, text, anchor]},
+        and the references of the notes listed in its Referenced In section at that time.
+    """
+    note = pw.ForeignKeyField(Note, on_delete='CASCADE', backref='build_labels')
+    format = pw.CharField()
+    labels = pw.TextField()
+    referrers = pw.TextField()
+
+    class Meta:
+        indexes = ((('note', 'format'), True),)
+
+
+class NoteIndex(FTS5Model):
+    """
+        Full text search index of note titles and bodies. The rowid is the id of the note.
+    """
+    rowid = RowIDField()
+    title = SearchField()
+    body = SearchField()
+
+    class Meta:
+        database = database
+        options = {'tokenize': 'porter unicode61'}
+
+def get_setting(key, default=None):
+    try:
+        return Setting.get(key=key).value
+    except (Setting.DoesNotExist, pw.OperationalError):
+        return default
+
+def set_setting(key, value):
+    try:
+        Setting.replace(key=key, value=str(value)).execute()
+    except pw.OperationalError:
+        #a database from before settings were stored
+        create_tables(Setting)
+        Setting.replace(key=key, value=str(value)).execute()
+
 def create_tables(*models):
     with database:
         database.create_tables(models)
 
 def create_all_tables():
-    create_tables(Note, Citation, Link, Label, Tag)
+    create_tables(Note, Setting, Citation, BibEntry, PendingBiber, Link, Label, Tag, NoteTag, Term, NoteVector, NoteIndex, NotePosition, MarkdownConversion, BlockIndex, Project, ProjectDependency, RenderRun, RenderJob, BuildLabels)
 
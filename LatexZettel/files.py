@@ -1,4 +1,5 @@
 import os
+import heapq
 from pathlib import Path
 
 def get_files(dir_name, extension=""):
@@ -6,6 +7,27 @@ def get_files(dir_name, extension=""):
     files = [f for f in files if '/.' not in str(f)]
     return files
 
+def scan_files(dir_name, extension=""):
+    """
+        Yields (path, mtime) for every file in dir_name (recursively) ending with extension, in a single os.scandir pass. Hidden files and folders are skipped.
+    """
+    stack = [dir_name]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith(extension):
+                    yield entry.path, entry.stat().st_mtime
+
+def get_recent_files(dir_name, n, extension=""):
+    """
+        The paths of the n most recently modified files in dir_name
+    """
+    return [path for path, mtime in heapq.nlargest(n, scan_files(dir_name, extension), key=lambda f: f[1])]
+
 def get_rendered_dates(extension='pdf', files=None):
     if files is None:
         files = get_files('notes', '.tex')
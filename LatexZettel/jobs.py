@@ -0,0 +1,106 @@
+"""
+    Render jobs stored in the database (RenderJob), so that a long render_all can be continued after it is interrupted. Jobs are claimed
+    atomically, so any number of worker threads (or processes) can take jobs from the same queue. The jobs of a pass are only started
+    once every job of the previous pass has finished.
+"""
+import datetime
+
+from . import database
+
+
+def enqueue(notes, format, passes=(1, 2)):
+    """
+        Replaces the jobs of the format with a job for each note and pass, with the notes rendered in the given order within each pass.
+    """
+    RenderJob = database.RenderJob
+    with database.database.atomic():
+        RenderJob.delete().where(RenderJob.format == format).execute()
+        rows = [(note.id, format, render_pass, priority) for render_pass in passes for priority, note in enumerate(notes)]
+        for i in range(0, len(rows), 500):
+            RenderJob.insert_many(rows[i:i + 500], fields=[RenderJob.note, RenderJob.format, RenderJob.render_pass, RenderJob.priority]).execute()
+
+
+def requeue(format, failed=True, stale=3600):
+    """
+        Queues the jobs left running by an interrupted run again, and (if failed) the jobs that failed, with their attempts reset. A job counts as
+        interrupted once it has been running for stale seconds, so that the jobs of a run still going on in another process are left alone, or
+        straight away if stale is None. Returns the number of jobs requeued.
+    """
+    RenderJob = database.RenderJob
+    interrupted = RenderJob.state == 'running'
+    if stale is not None:
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=float(stale))
+        interrupted = interrupted & (RenderJob.claimed.is_null() | (RenderJob.claimed < cutoff))
+    if failed:
+        interrupted = interrupted | (RenderJob.state == 'failed')
+    return (RenderJob
+            .update(state='queued', attempts=0, not_before=None)
+            .where(RenderJob.format == format, interrupted)
+            .execute())
+
+
+def remaining(format):
+    """
+        Number of jobs that are queued or running.
+    """
+    RenderJob = database.RenderJob
+    return RenderJob.select().where(RenderJob.format == format, RenderJob.state.in_(['queued', 'running'])).count()
+
+
+def claim(format):
+    """
+        Marks the next job that is ready as running and returns it, or None if there isn't one ready (all done, still running in another
+        worker, waiting to be retried, or waiting for the previous pass).
+    """
+    RenderJob = database.RenderJob
+    while True:
+        now = datetime.datetime.now()
+        current_pass = (RenderJob
+                        .select(RenderJob.render_pass)
+                        .where(RenderJob.format == format, RenderJob.state.in_(['queued', 'running']))
+                        .order_by(RenderJob.render_pass)
+                        .scalar())
+        if current_pass is None:
+            return None
+
+        job = (RenderJob
+               .select()
+               .where(RenderJob.format == format, RenderJob.render_pass == current_pass, RenderJob.state == 'queued',
+                      RenderJob.not_before.is_null() | (RenderJob.not_before <= now))
+               .order_by(RenderJob.priority, RenderJob.id)
+               .first())
+        if job is None:
+            return None
+
+        #only one worker can move the job out of queued
+        claimed = (RenderJob
+                   .update(state='running', attempts=RenderJob.attempts + 1, claimed=now)
+                   .where(RenderJob.id == job.id, RenderJob.state == 'queued')
+                   .execute())
+        if claimed == 1:
+            job.state = 'running'
+            job.attempts += 1
+            return job
+
+
+def finish(job, succeeded, max_attempts=3, backoff=5, retry=True):
+    """
+        Records the outcome of a claimed job. A failed job that can be retried (retry, eg it was killed rather than failing with a LaTeX error) is
+        queued again after backoff * 2^(attempts - 1) seconds, until it has been tried max_attempts times.
+    """
+    if succeeded:
+        job.state = 'done'
+    elif retry and job.attempts < int(max_attempts):
+        job.state = 'queued'
+        job.not_before = datetime.datetime.now() + datetime.timedelta(seconds=float(backoff) * 2 ** (job.attempts - 1))
+    else:
+        job.state = 'failed'
+    job.save()
+
+
+def failed(format):
+    """
+        Notes with a failed job in the format.
+    """
+    RenderJob = database.RenderJob
+    return list(database.Note.select().join(RenderJob).where(RenderJob.format == format, RenderJob.state == 'failed').distinct())
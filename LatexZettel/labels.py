@@ -0,0 +1,140 @@
+"""
+    Label level invalidation of renders. After a note is rendered the \\newlabel entries of its aux file are stored, so that when it is
+    rendered again only the notes linking to labels whose number, text or anchor changed need to be rendered again.
+"""
+import json
+import os
+import re
+
+from . import database
+
+
+NEWLABEL = re.compile(r'^\\newlabel\{(.*?)\}\{(.*)\}\s*$', re.M)
+
+
+def groups(text):
+    """
+        Splits {a}{b}{{c}d} into its top level brace groups ['a', 'b', '{c}d'].
+    """
+    result = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(text):
+        if c == '{':
+            if depth == 0:
+                start = i + 1
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                result.append(text[start:i])
+    return result
+
+
+def read_aux(path):
+    """
+        Returns {label: [number, text, anchor]} for the \\newlabel entries of the aux file. The page is left out since a note is not
+        re-rendered because the page of a label moved. Returns None if there is no aux file.
+    """
+    try:
+        with open(path, 'r', errors='replace') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+
+    labels = {}
+    for label, value in NEWLABEL.findall(text):
+        #hyperref writes {number}{page}{text}{anchor}{}, plain LaTeX {number}{page}
+        fields = groups(value) + ['', '', '', '']
+        labels[label] = [fields[0], fields[2], fields[3]]
+    return labels
+
+
+def changed(old, new):
+    """
+        The labels that were added, removed or have a different number, text or anchor.
+    """
+    return set(label for label in set(old) | set(new) if old.get(label) != new.get(label))
+
+
+def referrers(note):
+    """
+        References of the notes that link to note, ie the contents of its Referenced In section.
+    """
+    query = (database.Note
+             .select(database.Note.reference)
+             .join(database.Link, on=(database.Link.source == database.Note.id))
+             .join(database.Label)
+             .where(database.Label.note == note)
+             .distinct())
+    return sorted(reference for reference, in query.tuples())
+
+
+def load(note, format):
+    """
+        The labels stored for the last render of note, {} if it hasn't been rendered.
+    """
+    try:
+        return json.loads(database.BuildLabels.get(note=note, format=format).labels)
+    except database.BuildLabels.DoesNotExist:
+        return {}
+
+
+def load_referrers(note, format):
+    """
+        The references of the notes that linked to note when it was last rendered, [] if it hasn't been rendered.
+    """
+    try:
+        return json.loads(database.BuildLabels.get(note=note, format=format).referrers)
+    except database.BuildLabels.DoesNotExist:
+        return []
+
+
+def record(note, format):
+    """
+        Stores the labels in the aux file of the note that was just rendered into the folder format, and its current referrers.
+    """
+    labels = read_aux(os.path.join(format, f'{note.filename}.aux'))
+    if labels is None:
+        return
+    database.BuildLabels.replace(note=note, format=format, labels=json.dumps(labels), referrers=json.dumps(referrers(note))).execute()
+
+
+def dependents(note, labels, referrers=()):
+    """
+        Notes with links to any of the given labels of note, and the notes with references in referrers. The links to a label that has been
+        removed from note are deleted along with it, so the notes that linked to it can only be found from the referrers recorded when note
+        was last rendered (see load_referrers).
+    """
+    found = []
+    if len(labels) > 0:
+        found = list(database.Note
+                     .select()
+                     .join(database.Link, on=(database.Link.source == database.Note.id))
+                     .join(database.Label)
+                     .where(database.Label.note == note, database.Label.label.in_(list(labels)))
+                     .distinct())
+    referrers = set(referrers) - set(dependent.reference for dependent in found) - {note.reference}
+    if len(referrers) > 0:
+        found.extend(database.Note.select().where(database.Note.reference.in_(list(referrers))))
+    return found
+
+
+def stale_backlinks(format):
+    """
+        Rendered notes whose Referenced In section is out of date, because a link to them has been added or removed since.
+    """
+    current = {}
+    query = (database.Link
+             .select(database.Label.note, database.Note.reference)
+             .join(database.Label)
+             .switch(database.Link)
+             .join(database.Note, on=(database.Link.source == database.Note.id)))
+    for note_id, reference in query.tuples():
+        current.setdefault(note_id, set()).add(reference)
+
+    stale = []
+    for build in database.BuildLabels.select(database.BuildLabels.note, database.BuildLabels.referrers).where(database.BuildLabels.format == format):
+        if set(json.loads(build.referrers)) != current.get(build.note_id, set()):
+            stale.append(build.note_id)
+    return list(database.Note.select().where(database.Note.id.in_(stale))) if len(stale) > 0 else []
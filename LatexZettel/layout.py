@@ -0,0 +1,179 @@
+import numpy as np
+
+from . import database
+
+
+def load_positions():
+    """
+        Returns the stored network view positions as a dict {filename: (x, y)}
+    """
+    database.create_tables(database.NotePosition)
+    query = (database.NotePosition
+             .select(database.NotePosition, database.Note.filename)
+             .join(database.Note))
+    return {p.note.filename: (p.x, p.y) for p in query}
+
+
+def save_positions(positions):
+    """
+        Stores the positions {filename: (x, y)} of the notes in the database, replacing any previous positions.
+    """
+    database.create_tables(database.NotePosition)
+    ids = {note.filename: note.id for note in database.Note.select(database.Note.id, database.Note.filename)}
+    rows = [(ids[name], float(x), float(y)) for name, (x, y) in positions.items() if name in ids]
+    fields = [database.NotePosition.note, database.NotePosition.x, database.NotePosition.y]
+
+    with database.database.atomic():
+        for i in range(0, len(rows), 300):
+            database.NotePosition.replace_many(rows[i:i + 300], fields=fields).execute()
+
+
+def place_new_nodes(network, positions, iterations=50, seed=0):
+    """
+        Adds positions for the nodes of the network that don't have one. New nodes start at the mean of their placed neighbours (or at random if they have none) and are then relaxed for a few iterations, moving only the new nodes. Returns the positions and the list of new nodes.
+    """
+    rng = np.random.default_rng(seed)
+    new = [node for node in network.nodes if node not in positions]
+    if len(new) == 0:
+        return positions, new
+
+    if len(positions) > 0:
+        placed = np.array(list(positions.values()), dtype=float)
+        low, high = placed.min(axis=0), placed.max(axis=0)
+    else:
+        low, high = np.zeros(2), np.full(2, 100.0) * np.sqrt(len(new))
+
+    #typical distance between nodes, used for the spring length and the initial jitter
+    length = np.sqrt(np.prod(np.maximum(high - low, 1)) / max(len(network), 1))
+
+    positions = dict(positions)
+    for node in new:
+        neighbours = [n for n in nx_neighbours(network, node) if n in positions]
+        if len(neighbours) > 0:
+            positions[node] = tuple(np.mean([positions[n] for n in neighbours], axis=0) + rng.normal(0, length, 2))
+        else:
+            positions[node] = tuple(low + rng.random(2) * (high - low))
+
+    names = list(positions)
+    index = {name: i for i, name in enumerate(names)}
+    pos = np.array([positions[name] for name in names], dtype=float)
+    moving = np.array([index[node] for node in new])
+    neighbours = [[index[n] for n in nx_neighbours(network, node)] for node in new]
+
+    step = length
+    for _ in range(int(iterations)):
+        for i, node in enumerate(moving):
+            delta = pos[node] - pos
+            distance = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 1e-9)
+            #repulsion from every node, attraction to neighbours
+            force = np.sum(delta * (length ** 2 / distance ** 2)[:, None], axis=0)
+            for n in neighbours[i]:
+                d = pos[n] - pos[node]
+                force += d * np.hypot(*d) / length
+            norm = np.hypot(*force)
+            if norm > 0:
+                pos[node] += force / norm * min(norm, step)
+        step *= 0.9
+
+    return {name: (float(pos[index[name]][0]), float(pos[index[name]][1])) for name in names}, new
+
+
+def nx_neighbours(network, node):
+    if network.is_directed():
+        return set(network.predecessors(node)) | set(network.successors(node))
+    return set(network.neighbors(node))
+
+
+def force_layout(network, positions=None, iterations=200, callback=None, callback_every=10, seed=0):
+    """
+        Force directed (Fruchterman-Reingold) layout computed with numpy. Repulsion is approximated by binning the nodes into a grid and
+        repelling each node from the centre of mass of every cell, so each iteration costs O(N * cells) rather than O(N^2).
+
+        positions is an optional dict {node: (x, y)} used as a warm start; nodes missing from it start at random. If callback is given it is
+        called with the current positions every callback_every iterations, and the layout stops early if it returns False.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(network.nodes)
+    n = len(names)
+    if n == 0:
+        return {}
+    index = {name: i for i, name in enumerate(names)}
+
+    #ideal edge length is 1, so the nodes fill a square of side sqrt(n)
+    side = np.sqrt(n)
+    pos = rng.random((n, 2)) * side
+    temperature = side / 10
+    if positions:
+        known = [name for name in names if name in positions]
+        if len(known) > 0:
+            warm = np.array([positions[name] for name in known], dtype=float)
+            low, high = warm.min(axis=0), warm.max(axis=0)
+            span = np.maximum(high - low, 1e-9)
+            pos[[index[name] for name in known]] = (warm - low) / span.max() * side
+            #a warm start only needs to be adjusted
+            temperature = side / 100
+
+    edges = np.array([(index[s], index[d]) for s, d in network.edges if s != d], dtype=np.int64).reshape(-1, 2)
+    cells_per_side = int(np.clip(np.sqrt(n) / 3, 1, 32))
+    cooling = (1e-3) ** (1 / max(iterations, 1))
+
+    for iteration in range(int(iterations)):
+        displacement = _grid_repulsion(pos, cells_per_side)
+
+        if len(edges) > 0:
+            delta = pos[edges[:, 1]] - pos[edges[:, 0]]
+            distance = np.hypot(delta[:, 0], delta[:, 1])
+            force = delta * distance[:, None]
+            for axis in range(2):
+                displacement[:, axis] += np.bincount(edges[:, 0], weights=force[:, axis], minlength=n)
+                displacement[:, axis] -= np.bincount(edges[:, 1], weights=force[:, axis], minlength=n)
+
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        pos += displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature *= cooling
+
+        if callback is not None and (iteration + 1) % callback_every == 0:
+            if callback({name: (float(pos[i, 0]), float(pos[i, 1])) for i, name in enumerate(names)}) is False:
+                break
+
+    return {name: (float(pos[i, 0]), float(pos[i, 1])) for i, name in enumerate(names)}
+
+
+def _grid_repulsion(pos, cells_per_side, chunk=2048):
+    """
+        Approximate repulsive force k^2 / d (k = 1) on each node, using the centre of mass of each grid cell. A node's own contribution
+        is removed from its cell.
+    """
+    n = len(pos)
+    low = pos.min(axis=0)
+    size = np.maximum(pos.max(axis=0) - low, 1e-9) / cells_per_side
+    cell_xy = np.minimum(((pos - low) / size).astype(np.int64), cells_per_side - 1)
+    cell = cell_xy[:, 0] * cells_per_side + cell_xy[:, 1]
+    cells = cells_per_side ** 2
+
+    mass = np.bincount(cell, minlength=cells).astype(float)
+    centre = np.stack([np.bincount(cell, weights=pos[:, axis], minlength=cells) for axis in range(2)], axis=1)
+    occupied = mass > 0
+    mass, centre = mass[occupied], centre[occupied] / mass[occupied][:, None]
+    cell = np.cumsum(occupied)[cell] - 1
+
+    force = np.empty_like(pos)
+    for start in range(0, n, chunk):
+        p = pos[start:start + chunk]
+        own = cell[start:start + chunk]
+
+        delta = p[:, None, :] - centre[None, :, :]
+        distance_sq = np.maximum(np.sum(delta ** 2, axis=2), 1e-4)
+        weights = mass[None, :] / distance_sq
+        rows = np.arange(len(p))
+        #the node's own cell, without the node
+        weights[rows, own] = 0
+        force[start:start + chunk] = np.sum(delta * weights[:, :, None], axis=1)
+
+        own_mass = mass[own] - 1
+        own_centre = (centre[own] * mass[own][:, None] - p) / np.maximum(own_mass, 1)[:, None]
+        delta = p - own_centre
+        distance_sq = np.maximum(np.sum(delta ** 2, axis=1), 1e-4)
+        force[start:start + chunk] += delta * (own_mass / distance_sq)[:, None]
+
+    return force
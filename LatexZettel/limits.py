@@ -0,0 +1,91 @@
+"""
+    Runs the renderers with limits, so that one bad note can't hang or exhaust a batch: a wall clock timeout, and on Linux limits on
+    CPU time and memory (rlimits) for the renderer and everything it starts. The output is written straight to a log file instead of being
+    kept in memory.
+"""
+import os
+import signal
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    #not available on windows, only the timeout applies (as on systems without prlimit, eg macOS)
+    resource = None
+
+
+#return codes used for renders that were stopped. The timeout kills with SIGKILL, but is given a code of its own (not a signal number) so that a
+#render killed by something else, eg the OOM killer, isn't reported as timed out. Both are negative, like the codes of killed processes
+TIMED_OUT = -1000
+CPU_LIMIT = -getattr(signal, 'SIGXCPU', 24)
+
+
+def _set_limits(pid, cpu, memory):
+    """
+        Applies the limits to the running process pid. prlimit is used rather than a preexec_fn, which isn't safe when the renderers are started
+        from several threads. The processes the renderer starts inherit the limits.
+    """
+    if cpu:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (int(cpu), int(cpu) + 5))
+    if memory:
+        resource.prlimit(pid, resource.RLIMIT_AS, (int(memory), int(memory)))
+
+
+def run(command, log, input=None, timeout=None, cpu=None, memory=None, **kwargs):
+    """
+        Like subprocess.run, with stdout and stderr written to the file log. timeout is in seconds of wall time, cpu in seconds of CPU time and
+        memory in bytes of address space. A render that runs out of time is killed along with the processes it started, and gets the return
+        code TIMED_OUT. Returns a CompletedProcess whose stdout is the path of the log, and whose timed_out is True if the timeout was reached.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(log)), exist_ok=True)
+    if os.name == 'posix':
+        #a session of its own so that the whole process group can be killed
+        kwargs['start_new_session'] = True
+
+    with open(log, 'wb') as f:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL, stdout=f, stderr=subprocess.STDOUT, **kwargs)
+        if hasattr(resource, 'prlimit') and (cpu or memory):
+            try:
+                _set_limits(process.pid, cpu, memory)
+            except ProcessLookupError:
+                #already finished
+                pass
+        timed_out = False
+        try:
+            process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait()
+            f.write(f'\n! Killed after {timeout} seconds\n'.encode())
+
+    completed = subprocess.CompletedProcess(command, TIMED_OUT if timed_out else process.returncode, stdout=log)
+    completed.timed_out = timed_out
+    return completed
+
+
+def describe(returncode):
+    if returncode == TIMED_OUT:
+        return 'timed out'
+    elif returncode == CPU_LIMIT:
+        return 'CPU time limit'
+    elif returncode is not None and returncode < 0:
+        return f'killed by signal {-returncode}'
+    return f'exit code {returncode}'
+
+
+def first_error(log):
+    """
+        The first TeX error (a line starting with !) in the log, or None.
+    """
+    try:
+        with open(log, 'r', errors='replace') as f:
+            for line in f:
+                if line.startswith('!'):
+                    return line.strip()
+    except FileNotFoundError:
+        pass
+    return None
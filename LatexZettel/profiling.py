@@ -0,0 +1,125 @@
+"""
+    Lightweight instrumentation. When enabled (manage.py --profile) spans are recorded for the phases of a command, every subprocess
+    and every database query, and written out in the Chrome trace event format (open in chrome://tracing or https://ui.perfetto.dev).
+    When disabled span() and run() cost one attribute lookup.
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+enabled = False
+events = []
+counters = {'queries': 0, 'query_time': 0.0, 'subprocesses': 0, 'subprocess_time': 0.0}
+_lock = threading.Lock()
+_start = time.perf_counter()
+
+
+def _now():
+    return (time.perf_counter() - _start) * 1e6
+
+
+def _record(name, category, start, args):
+    event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': _now() - start, 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+    with _lock:
+        events.append(event)
+
+
+@contextmanager
+def span(name, category='phase', **args):
+    """
+        Records the wall time of the with block, and the number of database queries made during it.
+    """
+    if not enabled:
+        yield args
+        return
+    start = _now()
+    queries = counters['queries']
+    try:
+        yield args
+    finally:
+        args['queries'] = counters['queries'] - queries
+        _record(name, category, start, args)
+
+
+def traced(name, category='phase'):
+    """
+        Decorator recording a span for each call of the function, with its positional arguments.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with span(name, category, args=[str(a) for a in args]):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run(command, runner=None, **kwargs):
+    """
+        subprocess.run (or runner, which takes the same arguments), recording the command, wall time and exit code.
+    """
+    if runner is None:
+        import subprocess
+        runner = subprocess.run
+
+    if not enabled:
+        return runner(command, **kwargs)
+    start = _now()
+    process = None
+    try:
+        process = runner(command, **kwargs)
+        return process
+    finally:
+        duration = (_now() - start) / 1e6
+        with _lock:
+            counters['subprocesses'] += 1
+            counters['subprocess_time'] += duration
+        _record(os.path.basename(str(command[0])), 'subprocess', start, {'command': ' '.join(str(c) for c in command), 'cwd': kwargs.get('cwd') or os.getcwd(), 'returncode': None if process is None else process.returncode})
+
+
+def enable():
+    """
+        Starts recording, and counts the queries made through the slipbox database.
+    """
+    global enabled
+    if enabled:
+        return
+    enabled = True
+
+    from . import database
+    execute_sql = database.database.execute_sql
+    def counted_execute_sql(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return execute_sql(*args, **kwargs)
+        finally:
+            with _lock:
+                counters['queries'] += 1
+                counters['query_time'] += time.perf_counter() - start
+    database.database.execute_sql = counted_execute_sql
+
+
+def write_trace(filename):
+    """
+        Writes the recorded events as a Chrome trace, and prints a summary of the totals to stderr.
+    """
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': counters}, f)
+
+    totals = {}
+    for event in events:
+        key = (event['cat'], event['name'])
+        count, duration = totals.get(key, (0, 0))
+        totals[key] = (count + 1, duration + event['dur'])
+
+    print(f'profile written to {filename}', file=sys.stderr)
+    for (category, name), (count, duration) in sorted(totals.items(), key=lambda t: -t[1][1]):
+        print(f'{category}\t{name}\t{count}\t{duration / 1e3:.1f} ms', file=sys.stderr)
+    print(f"{counters['queries']} queries ({counters['query_time'] * 1e3:.1f} ms), {counters['subprocesses']} subprocesses ({counters['subprocess_time'] * 1e3:.1f} ms)", file=sys.stderr)
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import os
+
+from peewee import fn
+
+from . import database
+
+
+def expected_durations(format='pdf', history=5):
+    """
+        Returns {note_id: mean duration of a single pass} over the last few successful renders of each note in the given format.
+    """
+    RenderRun = database.RenderRun
+    recent = (RenderRun
+              .select(RenderRun.note, RenderRun.duration, RenderRun.passes,
+                      fn.ROW_NUMBER().over(partition_by=[RenderRun.note], order_by=[RenderRun.started.desc()]).alias('n'))
+              .where(RenderRun.format == format, RenderRun.returncode == 0))
+    totals = {}
+    for note_id, duration, passes, n in recent.tuples():
+        if n > history:
+            continue
+        count, total = totals.get(note_id, (0, 0))
+        totals[note_id] = (count + 1, total + duration / max(passes, 1))
+
+    return {note_id: total / count for note_id, (count, total) in totals.items()}
+
+
+def longest_first(notes, durations):
+    """
+        Orders the notes by expected duration, longest first, so that the slowest jobs don't end up at the end of a parallel batch. Notes that have
+        never been rendered are assumed to be as slow as the slowest known note.
+    """
+    unknown = max(durations.values(), default=0)
+    return sorted(notes, key=lambda note: -durations.get(note.id, unknown))
+
+
+def run_parallel(function, items, workers=None, stop=None):
+    """
+        Calls function on each item using a pool of worker threads, starting the items in order. Returns the results in the same order.
+        On KeyboardInterrupt the items that haven't started are cancelled and stop (a threading.Event the function checks) is set, so that
+        long running functions can return before the pool waits for them.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=int(workers)) as pool:
+        futures = [pool.submit(function, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        except KeyboardInterrupt:
+            if stop is not None:
+                stop.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+
+class RenderQueue:
+    """
+        Priority queue of notes to render. The focused (or most recently edited) note comes first, then the other edited notes, then the
+        notes that only need rendering again because something they depend on changed. Notes with the same priority are rendered in the
+        order they were added, and pushing a note that is already queued can only raise its priority.
+    """
+    FOCUSED = 0
+    EDITED = 1
+    DEPENDENT = 2
+
+    def __init__(self):
+        self.heap = []
+        self.queued = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queued)
+
+    def push(self, note, priority, biber=False):
+        if note.id in self.queued:
+            current, _, queued_biber = self.queued[note.id]
+            biber = biber or queued_biber
+            if current <= priority:
+                self.queued[note.id] = (current, note, biber)
+                return
+        #the old entry, if any, is left in the heap and skipped when popped
+        self.queued[note.id] = (priority, note, biber)
+        heapq.heappush(self.heap, (priority, next(self.counter), note.id))
+
+    def promote(self, filename, priority=FOCUSED):
+        """
+            Raises the priority of the queued note with the given filename, eg when an editor marks it as focused.
+        """
+        for current, note, biber in list(self.queued.values()):
+            if note.filename == filename and current > priority:
+                self.push(note, priority, biber)
+
+    def _discard_stale(self):
+        while len(self.heap) > 0:
+            priority, _, note_id = self.heap[0]
+            if note_id in self.queued and self.queued[note_id][0] == priority:
+                return
+            heapq.heappop(self.heap)
+
+    def peek_priority(self):
+        self._discard_stale()
+        return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def pop(self):
+        """
+            Removes and returns (note, priority, biber) for the next note to render.
+        """
+        self._discard_stale()
+        priority, _, note_id = heapq.heappop(self.heap)
+        _, note, biber = self.queued.pop(note_id)
+        return note, priority, biber
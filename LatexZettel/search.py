@@ -0,0 +1,65 @@
+import re
+
+import peewee as pw
+
+from . import database
+from .similarity import get_note_body, strip_latex
+
+
+def get_title(text):
+    m = re.search(r'\\title\{(.*?)\}', text)
+    if m is None:
+        return ''
+    return m.group(1)
+
+
+def update_index(note, text=None):
+    """
+        Replaces the full text search entry of the note with its current title and body.
+    """
+    if text is None:
+        with open(f'notes/slipbox/{note.filename}.tex', 'r') as f:
+            text = f.read()
+
+    body = ' '.join(strip_latex(get_note_body(text)).split())
+    database.NoteIndex.replace(rowid=note.id, title=get_title(text), body=body).execute()
+
+
+def remove_from_index(note):
+    database.NoteIndex.delete().where(database.NoteIndex.rowid == note.id).execute()
+
+
+def quote_terms(query):
+    """
+        The query with each word quoted as an FTS5 phrase, so that operators and punctuation in it are searched for as text.
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+def matches(query, n):
+    NoteIndex = database.NoteIndex
+    results = (NoteIndex
+               .select(NoteIndex.rowid, NoteIndex.body.snippet('[', ']', '...', 12).alias('snippet'))
+               .where(NoteIndex.match(query))
+               .order_by(NoteIndex.bm25(5.0, 1.0))
+               .limit(int(n)))
+    return [(r.rowid, r.snippet) for r in results]
+
+
+def search(query, n=10):
+    """
+        Returns a list of (note, snippet) for the n best matches of query, ranked by bm25 with titles weighted above bodies. A query that
+        isn't valid FTS5 syntax (eg C++ or a dangling AND) is searched for again with each word quoted, and gives no results if that fails too.
+    """
+    try:
+        hits = matches(database.NoteIndex.clean_query(query), n)
+    except pw.OperationalError:
+        try:
+            hits = matches(quote_terms(query), n)
+        except pw.OperationalError:
+            print('invalid query')
+            return []
+
+    notes = {note.id: note for note in database.Note.select().where(database.Note.id.in_([h[0] for h in hits]))}
+
+    return [(notes[note_id], snippet) for note_id, snippet in hits if note_id in notes]
@@ -0,0 +1,350 @@
+"""
+    A long running process that keeps the slipbox database open and answers requests from editors (and manage.py itself) over a Unix socket,
+    so that each call doesn't pay for starting Python, importing peewee and running a cold synchronize.
+
+    The protocol is JSON-RPC 2.0 with one JSON object per line. The method is the name of a Helper function and params are either its
+    arguments as a list, or an object {"args": [...], "wait": true, "stdin": ""}. Commands run one at a time on a background worker; with
+    "wait": false the call returns {"job": id} straight away and the job can be polled with the "job" method. Besides the Helper functions,
+    the server answers these from its in-memory caches without touching the worker:
+
+        ping                    {"pid": ..., "jobs": number of queued or running jobs}
+        resolve reference       filename of the note with the given \\externaldocument reference
+        graph                   {filename: [filenames it links to]}
+        files                   {path: mtime} for every note in notes/slipbox
+        changed                 paths of the notes modified since the last synchronize run by the server
+        focus filename          Helper.focus, run without waiting for the worker
+        job id                  {"state": queued|running|done|failed, "output": ..., "result": ...}
+        shutdown                stops the server
+
+    After each command only the cache entries of the notes it reread are recomputed (see Server.refresh), so the caches stay warm while notes
+    are edited and rendered.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+
+from . import lazy_import
+
+#only the commands need the database, forwarding a call to the server doesn't
+database = lazy_import('LatexZettel.database')
+files = lazy_import('LatexZettel.files')
+
+
+SOCKET = '.texnotes.sock'
+
+#serve would start another server, and edit changes the working directory of the whole process
+EXCLUDED = ['serve', 'edit']
+
+#commands that only change the notes in the database by synchronizing them, after which only the cache entries of the notes that were
+#reread (a new last_edit_date) are refreshed. Any other command could rename notes or references, so the caches are cleared
+INCREMENTAL = ['synchronize', 'render_updates', 'render', 'render_all', 'render_all_batched', 'render_resume', 'render_stats', 'search', 'related',
+               'list_recent_files', 'list_tags', 'notes_with_tag', 'notes_citing', 'unused_bib_entries', 'list_citations', 'list_unreferenced',
+               'update_projects', 'render_project', 'help']
+
+#JSON-RPC error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+COMMAND_ERROR = -32000
+
+
+def jsonable(value):
+    """
+        Helper functions return models and dicts keyed by models, which are sent as their string representations.
+    """
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+        Stand-in for sys.stdout and sys.stdin that lets each thread have its own stream, so the output of a command can be sent back to
+        the client that ran it. Threads without their own stream use the original.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def stream(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def set(self, stream):
+        self.local.stream = stream
+
+    def write(self, text):
+        return self.stream().write(text)
+
+    def readline(self, *args):
+        return self.stream().readline(*args)
+
+    def flush(self):
+        return self.stream().flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, commands, path=SOCKET):
+        """
+            commands is the object whose functions are exposed, ie manage.Helper.
+        """
+        self.commands = commands
+        self.path = path
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+        self.cache = {}
+        self.versions = {}
+        self.manifest = {}
+
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, Handler)
+
+    def command(self, name):
+        function = getattr(self.commands, name)
+        if name.startswith('_') or name in EXCLUDED or not callable(function):
+            raise AttributeError(name)
+        return function
+
+    def submit(self, name, args, stdin=''):
+        """
+            Queues the command on the worker, returning the job id.
+        """
+        function = self.command(name)
+        with self.lock:
+            job_id = next(self.job_ids)
+            job = {'id': job_id, 'method': name, 'state': 'queued', 'output': '', 'result': None}
+            self.jobs[job_id] = job
+
+        def run():
+            output = io.StringIO()
+            sys.stdout.set(output)
+            sys.stdin.set(io.StringIO(stdin))
+            job['state'] = 'running'
+            try:
+                job['result'] = jsonable(function(*args))
+                job['state'] = 'done'
+            except BaseException:
+                traceback.print_exc(file=output)
+                job['state'] = 'failed'
+            finally:
+                sys.stdout.set(None)
+                sys.stdin.set(None)
+                job['output'] = output.getvalue()
+                self.refresh(name in INCREMENTAL)
+                if name in ('synchronize', 'force_synchronize', 'render_updates'):
+                    self.manifest = dict(files.scan_files(os.path.join('notes', 'slipbox'), '.tex'))
+
+        job['future'] = self.worker.submit(run)
+        return job_id
+
+    def job(self, job_id, wait=False):
+        job = self.jobs[int(job_id)]
+        if wait:
+            job['future'].result()
+        response = {k: v for k, v in job.items() if k != 'future'}
+        if job['state'] in ('done', 'failed'):
+            del self.jobs[job['id']]
+        return response
+
+    def cached(self, key, function):
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = function()
+            return self.cache[key]
+
+    def edit_dates(self):
+        return {filename: str(date) for filename, date in database.Note.select(database.Note.filename, database.Note.last_edit_date).tuples()}
+
+    def refresh(self, incremental=True):
+        """
+            Brings the caches up to date after a command. Only the entries of the notes whose last_edit_date changed (or that were added or
+            removed) are recomputed, along with the graph entries of the notes linking to them, unless incremental is False.
+        """
+        with self.lock:
+            current = self.edit_dates()
+            if not incremental:
+                self.cache.clear()
+                self.versions = current
+                return
+            changed = set(f for f in set(current) | set(self.versions) if current.get(f) != self.versions.get(f))
+            self.versions = current
+            if len(changed) == 0:
+                return
+
+            if 'references' in self.cache:
+                references = {reference: filename for reference, filename in self.cache['references'].items() if filename not in changed}
+                references.update(self.references([f for f in changed if f in current]))
+                self.cache['references'] = references
+
+            if 'graph' in self.cache:
+                #a new dict, since a handler thread could be sending the old one
+                graph = dict(self.cache['graph'])
+                #a link to a label that was removed is deleted along with it, so the notes linking to changed notes are refreshed too
+                affected = changed | set(source for source, targets in graph.items() if not changed.isdisjoint(targets))
+                for filename in affected:
+                    graph.pop(filename, None)
+                graph.update(self.graph([f for f in affected if f in current]))
+                self.cache['graph'] = graph
+
+    def references(self, filenames=None):
+        query = database.Note.select(database.Note.reference, database.Note.filename)
+        if filenames is not None:
+            query = query.where(database.Note.filename.in_(list(filenames)))
+        return {note.reference: note.filename for note in query}
+
+    def graph(self, filenames=None):
+        """
+            {filename: [filenames it links to]} for the given notes, by default all of them.
+        """
+        Target = database.Note.alias()
+        query = (database.Link
+                 .select(database.Note.filename, Target.filename)
+                 .join(database.Note, on=(database.Link.source == database.Note.id))
+                 .switch(database.Link)
+                 .join(database.Label)
+                 .join(Target, on=(database.Label.note == Target.id)))
+        notes = database.Note.select(database.Note.filename)
+        if filenames is not None:
+            query = query.where(database.Note.filename.in_(list(filenames)))
+            notes = notes.where(database.Note.filename.in_(list(filenames)))
+        graph = {note.filename: [] for note in notes}
+        for source, target in query.tuples():
+            graph[source].append(target)
+        return graph
+
+    def changed(self):
+        current = dict(files.scan_files(os.path.join('notes', 'slipbox'), '.tex'))
+        return sorted(path for path, mtime in current.items() if self.manifest.get(path) != mtime)
+
+    def call(self, method, params):
+        if isinstance(params, dict):
+            args, wait, stdin = params.get('args', []), params.get('wait', True), params.get('stdin', '')
+        else:
+            args, wait, stdin = params or [], True, ''
+
+        if method == 'ping':
+            return {'pid': os.getpid(), 'jobs': len(self.jobs)}
+        elif method == 'resolve':
+            return self.cached('references', self.references).get(args[0])
+        elif method == 'graph':
+            return self.cached('graph', self.graph)
+        elif method == 'files':
+            return dict(files.scan_files(os.path.join('notes', 'slipbox'), '.tex'))
+        elif method == 'changed':
+            return self.changed()
+        elif method == 'job':
+            return self.job(args[0], wait)
+        elif method == 'focus':
+            #answered straight away so that it can reorder a render_updates that is already running
+            return self.commands.focus(*args)
+        elif method == 'shutdown':
+            #the server is stopped by the handler once the response has been sent
+            return None
+
+        job_id = self.submit(method, args, stdin)
+        if not wait:
+            return {'job': job_id}
+        return self.job(job_id, wait=True)
+
+    def server_close(self):
+        super().server_close()
+        self.worker.shutdown(wait=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.respond({'jsonrpc': '2.0', 'id': None, 'error': {'code': PARSE_ERROR, 'message': 'Parse error'}})
+                continue
+
+            response = {'jsonrpc': '2.0', 'id': request.get('id')}
+            try:
+                response['result'] = self.server.call(request.get('method', ''), request.get('params'))
+            except AttributeError:
+                response['error'] = {'code': METHOD_NOT_FOUND, 'message': f"Unrecognised command {request.get('method')}"}
+            except KeyError as e:
+                response['error'] = {'code': METHOD_NOT_FOUND, 'message': f'No job {e}'}
+            except Exception as e:
+                response['error'] = {'code': COMMAND_ERROR, 'message': str(e)}
+            self.respond(response)
+
+            if request.get('method') == 'shutdown':
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+    def respond(self, response):
+        self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+        self.wfile.flush()
+
+
+def serve(commands, path=SOCKET):
+    """
+        Runs the server until it is sent shutdown or interrupted. The slipbox is synchronized once at startup so that the caches are warm.
+    """
+    sys.stdout = ThreadOutput(sys.stdout)
+    sys.stdin = ThreadOutput(sys.stdin)
+    server = Server(commands, path)
+    server.job(server.submit('synchronize', []), wait=True)
+    server.refresh(incremental=False)
+    print(f'serving on {path}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout = sys.stdout.default
+        sys.stdin = sys.stdin.default
+
+
+def call(method, params=None, path=SOCKET):
+    """
+        Sends a single request to the server and returns the result. Raises OSError if no server is running and RuntimeError if the
+        request failed.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or []}).encode() + b'\n')
+        with client.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if 'error' in response:
+        raise RuntimeError(response['error']['message'])
+    return response['result']
+
+
+def forward(method, args, stdin='', path=SOCKET):
+    """
+        Runs the command on the server if there is one, printing its output. stdin is passed to the command for any prompts it shows.
+        Returns False if there is no server to forward to, and raises RuntimeError if the server refused the request or the command failed.
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return False
+
+    try:
+        job = call(method, {'args': args, 'stdin': stdin}, path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        #stale socket left by a server that didn't exit cleanly
+        return False
+
+    print(job['output'], end='')
+    if job['state'] == 'failed':
+        raise RuntimeError(f'{method} failed')
+    return True
@@ -0,0 +1,155 @@
+import re
+from array import array
+from collections import Counter
+
+from . import database
+
+
+STOP_WORDS = set('a an and are as at be by for from has have if in is it its of on or that the then this to was we which with'.split())
+
+
+def get_note_body(text, tag='note'):
+    """
+        Returns the contents of the %<*tag> ... %</tag> block of a note, or the whole text if there is no such block.
+    """
+    start = text.find(f'%<*{tag}>')
+    if start == -1:
+        return text
+    start += len(tag) + 4
+    end = text.find(f'%</{tag}>', start)
+    if end == -1:
+        return text[start:]
+    return text[start:end]
+
+
+def strip_latex(text):
+    """
+        Removes comments, maths and LaTeX commands (along with the arguments of referencing commands) from the text.
+    """
+    text = re.sub(r'(?<!\\)%.*', ' ', text)
+    text = re.sub(r'\$\$.*?\$\$|\$.*?\$|\\\[.*?\\\]', ' ', text, flags=re.S)
+    text = re.sub(r'\\(label|ref|cref|excref|exhyperref|cite\w*|parencite\w*|textcite|autocite\w*|begin|end|currentdoc)\*?(\[[^]]*\])*(\{[^}]*\})?', ' ', text)
+    text = re.sub(r'\\[A-Za-z@]+\*?', ' ', text)
+    return text
+
+
+def term_counts(text):
+    """
+        Term frequencies of the body of a note, with LaTeX stripped.
+    """
+    words = re.findall(r'[a-z][a-z\-]+', strip_latex(get_note_body(text)).lower())
+    return Counter(w for w in words if w not in STOP_WORDS)
+
+
+def update_vector(note, text=None):
+    """
+        Recalculates and stores the term frequency vector of the note. The vector is stored as two packed int32 arrays of term ids and counts.
+    """
+    if text is None:
+        with open(f'notes/slipbox/{note.filename}.tex', 'r') as f:
+            text = f.read()
+
+    counts = term_counts(text)
+
+    term_ids = {}
+    words = list(counts)
+    for i in range(0, len(words), 500):
+        chunk = words[i:i + 500]
+        for term in database.Term.select().where(database.Term.text.in_(chunk)):
+            term_ids[term.text] = term.id
+    missing = [w for w in words if w not in term_ids]
+    if len(missing) > 0:
+        with database.database.atomic():
+            for i in range(0, len(missing), 500):
+                database.Term.insert_many([(w,) for w in missing[i:i + 500]], fields=[database.Term.text]).execute()
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            for term in database.Term.select().where(database.Term.text.in_(chunk)):
+                term_ids[term.text] = term.id
+
+    ids = sorted(term_ids[w] for w in words)
+    inverse = {term_ids[w]: w for w in words}
+    database.NoteVector.replace(
+        note=note,
+        term_ids=array('i', ids).tobytes(),
+        counts=array('i', [counts[inverse[i]] for i in ids]).tobytes(),
+    ).execute()
+
+
+def prune_terms():
+    """
+        Deletes the terms that aren't in the vector of any note. This reads every vector, so it is left to force_synchronize.
+    """
+    used = set()
+    for (term_ids,) in database.NoteVector.select(database.NoteVector.term_ids).tuples():
+        used.update(array('i', bytes(term_ids)))
+
+    unused = [term_id for (term_id,) in database.Term.select(database.Term.id).tuples() if term_id not in used]
+    with database.database.atomic():
+        for i in range(0, len(unused), 500):
+            database.Term.delete().where(database.Term.id.in_(unused[i:i + 500])).execute()
+
+
+def load_matrix():
+    """
+        Loads the stored vectors into a sparse (CSR) tf-idf matrix with unit rows. Returns the note ids of the rows, and the indptr, indices and data arrays.
+    """
+    import numpy as np
+
+    note_ids = []
+    indptr = [0]
+    indices = []
+    data = []
+    for vector in database.NoteVector.select().order_by(database.NoteVector.note):
+        ids = np.frombuffer(vector.term_ids, dtype=np.int32)
+        counts = np.frombuffer(vector.counts, dtype=np.int32)
+        note_ids.append(vector.note_id)
+        indices.append(ids)
+        data.append(counts)
+        indptr.append(indptr[-1] + ids.size)
+
+    indptr = np.array(indptr, dtype=np.int64)
+    if len(note_ids) == 0:
+        return note_ids, indptr, np.zeros(0, dtype=np.int32), np.zeros(0)
+
+    indices = np.concatenate(indices)
+    data = np.concatenate(data).astype(float)
+
+    document_frequency = np.bincount(indices)
+    idf = np.log((1 + len(note_ids)) / (1 + document_frequency)) + 1
+    data = (1 + np.log(data)) * idf[indices]
+
+    rows = np.repeat(np.arange(len(note_ids)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=len(note_ids)))
+    norms[norms == 0] = 1
+    data /= norms[rows]
+
+    return note_ids, indptr, indices, data
+
+
+def related(note, k=10):
+    """
+        Returns a list of (note_id, similarity) for the k notes whose contents are most similar to note, by cosine similarity of tf-idf vectors.
+    """
+    import numpy as np
+
+    note_ids, indptr, indices, data = load_matrix()
+    try:
+        row = note_ids.index(note.id)
+    except ValueError:
+        return []
+
+    query = np.zeros(indices.max() + 1 if indices.size > 0 else 0)
+    query[indices[indptr[row]:indptr[row + 1]]] = data[indptr[row]:indptr[row + 1]]
+
+    rows = np.repeat(np.arange(len(note_ids)), np.diff(indptr))
+    similarity = np.bincount(rows, weights=data * query[indices], minlength=len(note_ids))
+    similarity[row] = -1
+
+    k = min(int(k), len(note_ids) - 1)
+    if k <= 0:
+        return []
+    best = np.argpartition(-similarity, k - 1)[:k]
+    best = best[np.argsort(-similarity[best])]
+
+    return [(note_ids[i], similarity[i]) for i in best if similarity[i] > 0]
@@ -0,0 +1,52 @@
+import re
+
+from peewee import fn
+
+from . import database
+
+
+def get_tags(text):
+    """
+        Tags of a note are given as a comma separated list on the last line of the file, after \\end{document}.
+    """
+    lines = text.rstrip().splitlines()
+    if len(lines) == 0 or re.search(r"\\end\{document\}", lines[-1]) is not None or lines[-1].lstrip().startswith('%'):
+        return set()
+    return set(tag.strip().lower() for tag in lines[-1].split(',') if tag.strip() != '')
+
+
+def update_tags(note, tags):
+    """
+        Replaces the tags of the note in the database with tags.
+    """
+    Tag, NoteTag = database.Tag, database.NoteTag
+    with database.database.atomic():
+        if len(tags) > 0:
+            Tag.insert_many([(t,) for t in tags], fields=[Tag.name]).on_conflict_ignore().execute()
+        ids = {t.name: t.id for t in Tag.select().where(Tag.name.in_(list(tags)))} if len(tags) > 0 else {}
+
+        current = set(nt.tag_id for nt in NoteTag.select(NoteTag.tag).where(NoteTag.note == note))
+        removed = current - set(ids.values())
+        if len(removed) > 0:
+            NoteTag.delete().where(NoteTag.note == note, NoteTag.tag.in_(list(removed))).execute()
+        added = [(note.id, tag_id) for tag_id in set(ids.values()) - current]
+        if len(added) > 0:
+            NoteTag.insert_many(added, fields=[NoteTag.note, NoteTag.tag]).execute()
+
+
+def tag_counts():
+    """
+        Returns a list of (tag, number of notes) for every tag in use, sorted by tag.
+    """
+    Tag, NoteTag = database.Tag, database.NoteTag
+    query = (Tag
+             .select(Tag.name, fn.COUNT(NoteTag.id).alias('count'))
+             .join(NoteTag)
+             .group_by(Tag.id)
+             .order_by(Tag.name))
+    return [(t.name, t.count) for t in query]
+
+
+def notes_with_tag(name):
+    Note, Tag, NoteTag = database.Note, database.Tag, database.NoteTag
+    return list(Note.select().join(NoteTag).join(Tag).where(Tag.name == name.lower()).order_by(Note.filename))
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import re
+
+from . import database
+
+
+#%<*tag> and %</tag>
+BLOCK = re.compile(rb'%<([*/])([^>\r\n]+)>')
+
+#\transclude[tag]{note}
+TRANSCLUDE = re.compile(r'\\transclude(?:\[([^]]+)\])?\{([^}]+)\}')
+
+#\ExecuteMetaData[../file]{tag}
+EXECUTE_METADATA = re.compile(r'\\ExecuteMetaData\[\.\./([^]]+)\]\{([^}]+)\}')
+
+
+class TransclusionError(Exception):
+    pass
+
+
+def index_blocks(content):
+    """
+        Returns {tag: (start, end)}, the byte ranges of the contents of the %<*tag> ... %</tag> blocks of content (bytes).
+    """
+    blocks = {}
+    opened = {}
+    for m in BLOCK.finditer(content):
+        tag = m.group(2).decode()
+        if m.group(1) == b'*':
+            opened.setdefault(tag, m.end())
+        elif tag in opened and tag not in blocks:
+            blocks[tag] = (opened.pop(tag), m.start())
+
+    return blocks
+
+
+def block_hash(text):
+    if text is None:
+        return ''
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def note_path(note):
+    return os.path.join('notes', 'slipbox', f'{note}.tex')
+
+
+class Transcluder:
+    """
+        Replaces \\transclude commands (or \\ExecuteMetaData commands if metadata is True) with the blocks they refer to. Each file is read and indexed at most once, and the
+        block index of each file is cached in the database (BlockIndex) keyed on the hash of its contents. Transclusions inside transcluded
+        blocks are expanded too, and each expanded block is memoised.
+    """
+    def __init__(self, metadata=False):
+        self.metadata = metadata
+        self.files = {}
+        self.expanded = {}
+        self.cache = None
+        self.updated = {}
+        self.dependencies = {}
+
+    def load(self, path):
+        """
+            Returns the contents of path and the index of its blocks.
+        """
+        try:
+            return self.files[path]
+        except KeyError:
+            pass
+
+        if self.cache is None:
+            database.database.create_tables([database.BlockIndex])
+            self.cache = {b.path: (b.content_hash, b.blocks) for b in database.BlockIndex}
+
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        content_hash = hashlib.sha1(content).hexdigest()
+        cached_hash, blocks = self.cache.get(path, (None, None))
+        if cached_hash == content_hash:
+            blocks = {tag: tuple(r) for tag, r in json.loads(blocks).items()}
+        else:
+            blocks = index_blocks(content)
+            self.updated[path] = (content_hash, json.dumps(blocks))
+
+        self.files[path] = (content, blocks)
+        return self.files[path]
+
+    def block(self, path, tag):
+        """
+            The raw text of the block tag in path, or None if there is no such block.
+        """
+        content, blocks = self.load(path)
+        try:
+            start, end = blocks[tag]
+        except KeyError:
+            return None
+        return content[start:end].decode()
+
+    def transclude(self, path, tag, stack=()):
+        """
+            The text of the block tag in path with its own transclusions expanded.
+        """
+        key = (path, tag)
+        if key in stack:
+            cycle = ' -> '.join(f'{p}[{t}]' for p, t in stack[stack.index(key):] + (key,))
+            raise TransclusionError(f'Transclusion cycle: {cycle}')
+
+        try:
+            return self.expanded[key]
+        except KeyError:
+            pass
+
+        text = self.block(path, tag)
+        self.dependencies[key] = block_hash(text)
+        if text is None:
+            print(f'Warning: no block {tag} in {path}')
+            text = ''
+        text = self.expand(text, stack + (key,)).strip()
+
+        self.expanded[key] = text
+        return text
+
+    def expand(self, text, stack=()):
+        """
+            Replaces every transclusion in text.
+        """
+        if self.metadata:
+            return EXECUTE_METADATA.sub(lambda m: self.transclude(m.group(1), m.group(2), stack), text)
+        return TRANSCLUDE.sub(lambda m: self.transclude(note_path(m.group(2)), m.group(1) or 'note', stack), text)
+
+    def unchanged(self, dependencies):
+        """
+            True if every (path, tag, hash) in dependencies still has the same contents.
+        """
+        for path, tag, recorded_hash in dependencies:
+            try:
+                if block_hash(self.block(path, tag)) != recorded_hash:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def save(self):
+        """
+            Stores the block indices of the files that have changed since they were last cached.
+        """
+        if len(self.updated) == 0:
+            return
+        rows = [(path, content_hash, blocks) for path, (content_hash, blocks) in self.updated.items()]
+        fields = [database.BlockIndex.path, database.BlockIndex.content_hash, database.BlockIndex.blocks]
+        with database.database.atomic():
+            for i in range(0, len(rows), 300):
+                database.BlockIndex.replace_many(rows[i:i + 300], fields=fields).execute()
+        self.updated = {}
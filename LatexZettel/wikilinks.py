@@ -0,0 +1,73 @@
+import re
+
+
+#[[file]], [[file#label]], [[file#^label]], [[file|text]] and [[file#label|text]]
+WIKILINK = re.compile(r"\[\[([^{\#\]\|}\n]+)(?:\#\^?([^]|\n]+))?(?:\|([^]\n]+))?\]\]")
+
+
+def to_latex(reference, label=None, text=None):
+    label = '' if label is None else f'[{label}]'
+    if text is None:
+        return f'\\excref{label}{{{reference}}}'
+    return f'\\exhyperref{label}{{{reference}}}{{{text}}}'
+
+
+def rewrite(text, resolve=None):
+    """
+        Replaces every wikilink in text with \\excref or \\exhyperref in a single pass. resolve maps the linked file name to the reference of the note,
+        by default the name is used as the reference. If resolve returns None the link is left unchanged.
+    """
+    def replace(m):
+        reference = m.group(1) if resolve is None else resolve(m.group(1))
+        if reference is None:
+            return m.group(0)
+        return to_latex(reference, m.group(2), m.group(3))
+
+    return WIKILINK.sub(replace, text)
+
+
+def rewrite_stream(infile, outfile, resolve=None, chunk_size=1 << 16):
+    """
+        Rewrites the wikilinks of a file object in chunks of whole lines (links never span lines), writing to outfile, so that the input never needs to be held in memory.
+    """
+    while True:
+        lines = infile.readlines(chunk_size)
+        if len(lines) == 0:
+            break
+        outfile.write(rewrite(''.join(lines), resolve))
+
+
+#\excref[label]{Reference} and \exhyperref[label]{Reference}{text}
+LATEX_LINK = re.compile(r"\\excref(?:\[([^]]+)\])?\{([^}]*)\}|\\exhyperref(?:\[([^]]+)\])?\{([^}]*)\}\{([^}]*)\}")
+
+
+def to_wikilink(name, label=None, text=None):
+    link = name
+    if label is not None and label != 'note':
+        link += f'#{label}'
+    if text is not None:
+        link += f'|{text}'
+    return f'[[{link}]]'
+
+
+def latex_link_to_wikilink(m, resolve=None):
+    """
+        Converts a match of LATEX_LINK to a wikilink. resolve maps the reference to the linked file name, by default the reference is used.
+        If resolve returns None the link is left unchanged.
+    """
+    if m.group(2) is not None:
+        label, reference, text = m.group(1), m.group(2), None
+    else:
+        label, reference, text = m.group(3), m.group(4), m.group(5)
+
+    name = reference if resolve is None else resolve(reference)
+    if name is None:
+        return m.group(0)
+    return to_wikilink(name, label, text)
+
+
+def from_latex(text, resolve=None):
+    """
+        Replaces every \\excref and \\exhyperref in text with a wikilink in a single pass.
+    """
+    return LATEX_LINK.sub(lambda m: latex_link_to_wikilink(m, resolve), text)
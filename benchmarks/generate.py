@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+    Generates a synthetic slipbox for benchmarking, with notes made from template/note.tex.
+
+    `python benchmarks/generate.py directory [--notes N] [--links L] [--labels L] [--citations C] [--tags T] [--seed S]`
+
+    The directory gets a copy of template/, config/ and pandoc/, notes/slipbox/*.tex, notes/documents.tex and bibliography.bib. Run
+    manage.py from inside it (eg `cd directory && python path/to/manage.py force_synchronize`).
+"""
+import argparse
+import os
+import random
+import shutil
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+WORDS = ('group ring field module vector space linear map kernel image basis dimension eigenvalue matrix topology compact open set '
+         'metric continuous function sequence limit series integral measure category functor morphism object sheaf scheme').split()
+
+
+def note_name(i):
+    return f'note_{i}'
+
+
+def reference_name(i):
+    return ''.join(w.capitalize() for w in note_name(i).split('_'))
+
+
+def generate(directory, notes=100, links=3, labels=2, citations=1, tags=2, seed=0, words=80):
+    """
+        Writes a slipbox of notes notes to directory. Each note has labels labelled equations, links \\excref links to random labels of other
+        notes, citations \\cite keys from bibliography.bib and tags tags on the last line.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, 'notes', 'slipbox'), exist_ok=True)
+    for folder in ['template', 'config', 'pandoc']:
+        target = os.path.join(directory, folder)
+        if not os.path.exists(target):
+            shutil.copytree(os.path.join(ROOT, folder), target)
+
+    with open(os.path.join(ROOT, 'template', 'note.tex'), 'r') as f:
+        template = f.read()
+
+    bib_keys = [f'author{i}' for i in range(max(notes // 10, 1))]
+    with open(os.path.join(directory, 'bibliography.bib'), 'w') as f:
+        for key in bib_keys:
+            f.write(f'@article{{{key},\n    author = {{Author, {key.capitalize()}}},\n    title = {{On {rng.choice(WORDS)} {rng.choice(WORDS)}}},\n    year = {{{rng.randint(1950, 2024)}}},\n    journal = {{Journal}}\n}}\n\n')
+
+    tag_names = [f'tag{i}' for i in range(max(notes // 20, 1))]
+
+    with open(os.path.join(directory, 'notes', 'documents.tex'), 'w') as documents:
+        for i in range(notes):
+            documents.write(f'\\externaldocument[{reference_name(i)}-]{{{note_name(i)}}}\n')
+
+            body = []
+            for j in range(labels):
+                body.append(' '.join(rng.choices(WORDS, k=words // (labels + 1))))
+                body.append(f'\\begin{{equation}} x_{{{j}}} = y^{{{j}}} \\label{{eq{j}}} \\end{{equation}}')
+            body.append(' '.join(rng.choices(WORDS, k=words // (labels + 1))))
+
+            for _ in range(links if notes > 1 else 0):
+                target = rng.randrange(notes - 1)
+                target += target >= i
+                label = rng.randrange(labels + 1)
+                if label == labels:
+                    body.append(f'\\excref{{{reference_name(target)}}}')
+                else:
+                    body.append(f'\\excref[eq{label}]{{{reference_name(target)}}}')
+
+            for _ in range(citations):
+                body.append(f'\\cite{{{rng.choice(bib_keys)}}}')
+
+            title = ' '.join(s.capitalize() for s in note_name(i).split('_'))
+            text = template.replace('Note Title', title).replace('%Write Note here', '\n        '.join(body))
+            if tags > 0:
+                text = text.rstrip('\n') + '\n' + ', '.join(rng.sample(tag_names, min(tags, len(tag_names)))) + '\n'
+
+            with open(os.path.join(directory, 'notes', 'slipbox', f'{note_name(i)}.tex'), 'w') as f:
+                f.write(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic slipbox')
+    parser.add_argument('directory')
+    parser.add_argument('--notes', type=int, default=100)
+    parser.add_argument('--links', type=int, default=3)
+    parser.add_argument('--labels', type=int, default=2)
+    parser.add_argument('--citations', type=int, default=1)
+    parser.add_argument('--tags', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.directory, args.notes, args.links, args.labels, args.citations, args.tags, args.seed)
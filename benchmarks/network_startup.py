@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+    Times the construction of the network view (network.App) for random graphs of increasing size, using precomputed positions so that
+    only the canvas construction is measured. Requires a display.
+
+    `python benchmarks/network_startup.py [sizes...]`
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import networkx as nx
+import numpy as np
+
+
+def main(sizes):
+    import network
+
+    print('nodes\tedges\tstartup (s)\tper node (ms)')
+    for n in sizes:
+        graph = nx.gnm_random_graph(n, 3 * n, seed=0, directed=True)
+        graph = nx.relabel_nodes(graph, {i: f'note_{i}' for i in graph.nodes})
+        rng = np.random.default_rng(0)
+        positions = {name: tuple(rng.random(2) * 1000) for name in graph.nodes}
+
+        start = time.perf_counter()
+        app = network.App(graph, positions=positions)
+        app.update()
+        elapsed = time.perf_counter() - start
+        app.close()
+
+        print(f'{n}\t{graph.number_of_edges()}\t{elapsed:.3f}\t{elapsed / n * 1000:.3f}')
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1:]] or [250, 500, 1000, 2000, 4000, 8000]
+    main(sizes)
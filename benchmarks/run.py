@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+    Runs the manage.py commands against generated slipboxes of increasing size and reports the wall time, number of database
+    queries, number of subprocesses and peak memory of each. pdflatex, make4ht, biber and pandoc are replaced by the stubs in
+    benchmarks/stubs, so no TeX installation is needed and render scheduling can be measured on its own.
+
+    `python benchmarks/run.py [--sizes 100 1000 10000 50000] [--latency 0.05] [--commands ...] [--keep DIR]`
+
+    Commands are run in order on the same slipbox, so eg `synchronize` after `force_synchronize` measures a sync with nothing to do and
+    `touch` marks 1% of the notes as edited before the following command.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import generate
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MANAGE = os.path.join(HERE, '..', 'manage.py')
+
+COMMANDS = ['force_synchronize', 'synchronize', 'touch', 'synchronize', 'list_unreferenced', 'render_all', 'touch', 'render_updates']
+
+#commands whose cost grows faster than the slipbox, skipped above the given number of notes
+LIMITS = {'list_unreferenced': 10000, 'render_all': 5000, 'render_updates': 20000}
+
+
+def touch(directory, fraction=0.01):
+    """
+        Marks a fraction of the notes as edited by updating their modification times.
+    """
+    slipbox = os.path.join(directory, 'notes', 'slipbox')
+    names = sorted(os.listdir(slipbox))
+    step = max(int(1 / fraction), 1)
+    now = time.time() + 1
+    for name in names[::step]:
+        os.utime(os.path.join(slipbox, name), (now, now))
+    return len(names[::step])
+
+
+def run_command(directory, command, env):
+    """
+        Runs manage.py with profiling on in directory. Returns the wall time, the counters from the trace, peak memory (MB) and the return code.
+    """
+    trace = os.path.join(directory, 'profile.json')
+    if os.path.exists(trace):
+        os.remove(trace)
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, MANAGE, f'--profile={trace}', command], cwd=directory, env=env,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+
+    counters = {}
+    if os.path.exists(trace):
+        with open(trace, 'r') as f:
+            counters = json.load(f).get('otherData', {})
+
+    #ru_maxrss is in kilobytes on linux and bytes on macos
+    peak = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return elapsed, counters, peak, os.waitstatus_to_exitcode(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark manage.py commands on synthetic slipboxes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--commands', nargs='+', default=COMMANDS)
+    parser.add_argument('--links', type=int, default=3)
+    parser.add_argument('--labels', type=int, default=2)
+    parser.add_argument('--citations', type=int, default=1)
+    parser.add_argument('--tags', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each stub TeX/pandoc invocation takes')
+    parser.add_argument('--keep', help='generate the slipboxes in this directory and keep them')
+    parser.add_argument('--no-limits', action='store_true', help='run every command at every size')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PATH'] = os.path.join(HERE, 'stubs') + os.pathsep + env.get('PATH', '')
+    env['TEXNOTES_STUB_LATENCY'] = str(args.latency)
+
+    print('notes\tcommand\twall (s)\tqueries\tsubprocesses\tpeak (MB)\treturn')
+    for size in args.sizes:
+        root = args.keep or tempfile.mkdtemp(prefix='texnotes-bench-')
+        directory = os.path.join(root, f'slipbox_{size}')
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+
+        start = time.perf_counter()
+        generate(directory, size, args.links, args.labels, args.citations, args.tags)
+        print(f'{size}\tgenerate\t{time.perf_counter() - start:.3f}\t\t\t\t', flush=True)
+
+        for command in args.commands:
+            if command == 'touch':
+                touched = touch(directory)
+                print(f'{size}\ttouch ({touched})\t\t\t\t\t', flush=True)
+                continue
+            if not args.no_limits and size > LIMITS.get(command, size):
+                print(f'{size}\t{command}\tskipped\t\t\t\t', flush=True)
+                continue
+
+            elapsed, counters, peak, returncode = run_command(directory, command, env)
+            print(f"{size}\t{command}\t{elapsed:.3f}\t{counters.get('queries', '')}\t{counters.get('subprocesses', '')}\t{peak:.1f}\t{returncode}", flush=True)
+
+        if args.keep is None:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
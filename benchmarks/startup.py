@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+    Times the startup of manage.py for commands that do little work, and lists the modules each one imports, to check that
+    commands only load the subsystems they need.
+
+    `python benchmarks/startup.py [--repeat 10] [commands...]`
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import generate
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MANAGE = os.path.join(HERE, '..', 'manage.py')
+
+COMMANDS = [['help'], ['list_recent_files', '5'], ['newnote', 'startup_note_{i}'], ['search', 'group'], ['list_unreferenced']]
+
+#modules that are slow to import and should only be loaded by the commands that use them
+HEAVY = ['peewee', 'numpy', 'LatexZettel.database', 'concurrent.futures', 'subprocess', 'socketserver']
+
+REPORT = 'import os, sys, runpy; sys.path.insert(0, os.path.dirname({manage!r})); sys.argv = {argv!r}; runpy.run_path({manage!r}, run_name="__main__"); print("\\t" + " ".join(m for m in {heavy!r} if type(sys.modules.get(m)).__name__ == "module"), file=sys.stderr)'
+
+
+def run(directory, argv):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, MANAGE] + argv, cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imported(directory, argv):
+    """
+        The slow modules that were loaded (rather than just registered for lazy loading) by the command.
+    """
+    code = REPORT.format(argv=['manage.py'] + argv, manage=MANAGE, heavy=HEAVY)
+    process = subprocess.run([sys.executable, '-c', code], cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return process.stderr.strip().split('\t')[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of manage.py')
+    parser.add_argument('commands', nargs='*', help='a command to time, eg "list_recent_files 5"')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--notes', type=int, default=100)
+    args = parser.parse_args()
+    commands = [c.split() for c in args.commands] or COMMANDS
+
+    directory = tempfile.mkdtemp(prefix='texnotes-startup-')
+    try:
+        generate(directory, args.notes)
+        run(directory, ['force_synchronize'])
+
+        print('command\tmedian (ms)\tmin (ms)\tslow imports')
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'])
+            times.append(time.perf_counter() - start)
+        print(f'(python -c pass)\t{statistics.median(times) * 1e3:.1f}\t{min(times) * 1e3:.1f}\t')
+
+        for argv in commands:
+            #{i} in an argument is replaced by the repetition number, eg so that newnote creates a different note each time
+            times = [run(directory, [a.replace('{i}', str(i)) for a in argv]) for i in range(args.repeat)]
+            print(f"{' '.join(argv)}\t{statistics.median(times) * 1e3:.1f}\t{min(times) * 1e3:.1f}\t{imported(directory, [a.replace('{i}', 'x') for a in argv])}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
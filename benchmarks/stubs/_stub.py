@@ -0,0 +1,137 @@
+"""
+    Stand-ins for the TeX toolchain, pandoc and qpdf so that the render and conversion scheduling can be measured without TeX installed.
+    They write plausible outputs (.pdf, .aux with \\newlabel entries, .bcf, .bbl, .html, .tex) and sleep to simulate the cost of the real tool.
+
+    TEXNOTES_STUB_LATENCY           seconds each invocation takes (default 0.05)
+    TEXNOTES_STUB_LATENCY_<TOOL>    override for one tool, eg TEXNOTES_STUB_LATENCY_BIBER
+    TEXNOTES_STUB_FAIL              invocations whose input contains this string exit with an error
+"""
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+
+def latency(tool):
+    return float(os.environ.get(f'TEXNOTES_STUB_LATENCY_{tool.upper()}', os.environ.get('TEXNOTES_STUB_LATENCY', '0.05')))
+
+
+def should_fail(text):
+    pattern = os.environ.get('TEXNOTES_STUB_FAIL')
+    return pattern is not None and pattern in text
+
+
+def option(args, names, default=None):
+    for i, arg in enumerate(args):
+        for name in names:
+            if arg == name and i + 1 < len(args):
+                return args[i + 1]
+            if arg.startswith(name + '='):
+                return arg.split('=', 1)[1]
+    return default
+
+
+def write_aux(jobname, document):
+    with open(f'{jobname}.aux', 'w') as f:
+        f.write('\\relax\n')
+        for i, label in enumerate(re.findall(r'\\(?:label|currentdoc)\{([^}]*)\}', document)):
+            f.write(f'\\newlabel{{{label}}}{{{{{i + 1}}}{{1}}{{}}{{equation.{i + 1}}}{{}}}}\n')
+        for key in re.findall(r'\\cite\{([^}]*)\}', document):
+            f.write(f'\\abx@aux@cite{{0}}{{{key}}}\n')
+        #batch documents, one page per note
+        marks = re.findall(r'\\texnotesmark\{([^}]*)\}', document)
+        for i, reference in enumerate(marks):
+            f.write(f'\\texnotesstart{{{reference}}}{{{i + 1}}}\n')
+        if len(marks) > 0:
+            f.write(f'\\texnotespages{{{len(marks)}}}\n')
+
+
+def tex(tool, args):
+    document = sys.stdin.read() if not sys.stdin.isatty() else ''
+    inputs = [a for a in args if not a.startswith('-') and a.endswith('.tex')]
+    if len(inputs) > 0:
+        with open(inputs[0], 'r') as f:
+            document = f.read()
+
+    directory = option(args, ['-output-directory', '--output-directory'], '.')
+    jobname = option(args, ['--jobname', '-jobname', '-j'], os.path.basename(inputs[0])[:-4] if inputs else 'texput')
+    jobname = os.path.join(directory, jobname)
+
+    time.sleep(latency(tool))
+    write_aux(jobname, document)
+    with open(f'{jobname}.log', 'w') as f:
+        f.write(f'This is {tool} (stub)\n')
+    if '\\printbibliography' in document or '\\cite' in document:
+        with open(f'{jobname}.bcf', 'w') as f:
+            f.write('<bcf/>\n')
+
+    if should_fail(document):
+        print(f'! Stub error in {jobname}')
+        return 1
+
+    if tool == 'make4ht':
+        with open(f'{jobname}.html', 'w') as f:
+            f.write(f'<html><body>{jobname}</body></html>\n')
+    else:
+        with open(f'{jobname}.pdf', 'wb') as f:
+            f.write(b'%PDF-1.5 stub\n')
+    return 0
+
+
+def biber(args):
+    time.sleep(latency('biber'))
+    jobname = [a for a in args if not a.startswith('-')][-1]
+    with open(f'{jobname}.bbl', 'w') as f:
+        f.write('% stub bbl\n')
+    return 0
+
+
+def pandoc(args):
+    time.sleep(latency('pandoc'))
+    if len(args) > 0 and args[0] == 'lua':
+        #pandoc/batch.lua protocol
+        for job in json.load(sys.stdin):
+            with open(job['output'], 'w') as f:
+                f.write(latex_note(job['text']))
+            print(f"ok\t{job['output']}")
+        return 0
+
+    text = sys.stdin.read()
+    if should_fail(text):
+        print('stub pandoc error', file=sys.stderr)
+        return 1
+
+    output = option(args, ['-o'])
+    converted = latex_note(text) if option(args, ['-t']) == 'latex' else text
+    if output is None:
+        sys.stdout.write(converted)
+    else:
+        with open(output, 'w') as f:
+            f.write(converted)
+    return 0
+
+
+def latex_note(text):
+    return f'\\documentclass{{../template/texnote}}\n\\begin{{document}}\n    \\maketitle \\currentdoc{{note}}\n    %<*note>\n{text}\n    %</note>\n\\end{{document}}\n'
+
+
+def qpdf(args):
+    time.sleep(latency('qpdf'))
+    #qpdf input.pdf --pages . first-last -- output.pdf, see LatexZettel/batch.py
+    shutil.copyfile(args[0], args[-1])
+    return 0
+
+
+def main(tool):
+    args = sys.argv[1:]
+    if tool in ('pdflatex', 'make4ht'):
+        return tex(tool, args)
+    elif tool == 'biber':
+        return biber(args)
+    elif tool == 'pandoc':
+        return pandoc(args)
+    elif tool == 'qpdf':
+        return qpdf(args)
+    raise ValueError(f'No stub for {tool}')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+    Throughput of the single pass wikilink rewriter (LatexZettel.wikilinks) on generated markdown of a few sizes, compared with the
+    previous four pass implementation.
+
+    `python benchmarks/wikilinks.py [megabytes...]`
+"""
+import io
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from LatexZettel import wikilinks
+
+
+def generate(size, seed=0):
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'theorem', 'proof', 'group', '$x^2$', 'ring']
+    links = ['[[note {}]]', '[[note {}#label]]', '[[note {}|some text]]', '[[note {}#^label|text]]']
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(words) if rng.random() > 0.05 else rng.choice(links).format(rng.randrange(1000)) for _ in range(16)) + '\n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+
+def four_pass(text):
+    text = re.sub(r"\[\[([^{\#\]\|}]+)\]\]", lambda m: f"\\excref{{{m.group(1)}}}", text)
+    text = re.sub(r"\[\[([^{\#\]\|}]+)\#\^?([^]]+)\]\]", lambda m: f"\\excref[{m.group(2)}]{{{m.group(1)}}}", text)
+    text = re.sub(r"\[\[([^{\#\]\|}]+)\|([^]]+)\]\]", lambda m: f"\\exhyperref{{{m.group(1)}}}{{{m.group(2)}}}", text)
+    text = re.sub(r"\[\[([^{\#\]\|}]+)\#\^?([^]]+)\|([^]]+)\]\]", lambda m: f"\\exhyperref[{m.group(2)}]{{{m.group(1)}}}{{{m.group(3)}}}", text)
+    return text
+
+
+def measure(function, text, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text) / best / 1e6
+
+
+def main(sizes):
+    print('size (MB)\tfour pass (MB/s)\tsingle pass (MB/s)\tstream (MB/s)')
+    for size in sizes:
+        text = generate(int(size * 1e6))
+        stream = lambda t: wikilinks.rewrite_stream(io.StringIO(t), io.StringIO())
+        print(f'{size}\t{measure(four_pass, text):.1f}\t{measure(wikilinks.rewrite, text):.1f}\t{measure(stream, text):.1f}')
+
+
+if __name__ == '__main__':
+    sizes = [float(s) for s in sys.argv[1:]] or [1, 4, 16]
+    main(sizes)
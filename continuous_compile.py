@@ -1,4 +1,4 @@
-import sys, time
+import sys, time, statistics
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -7,6 +7,7 @@ from manage import Helper
 class Handler(FileSystemEventHandler):
     def __init__(self, *args):
         self.last_update_time = 0
+        self.latencies = []
         super().__init__(*args)
     
     def on_modified(self, event):
@@ -14,7 +15,14 @@ class Handler(FileSystemEventHandler):
 
         if time.time() - self.last_update_time > 5:
 
-            Helper.render_updates()
+            if event.src_path.endswith('.md'):
+                Helper.sync_md('--yes')
+
+            latencies = Helper.render_updates()
+            for filename, latency in latencies.items():
+                self.latencies.append(latency)
+                print(f'{filename}: saved to rendered in {latency:.2f}s (median {statistics.median(self.latencies):.2f}s)')
+            Helper.update_projects()
              
             self.last_update_time = time.time()
 
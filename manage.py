@@ -1,21 +1,41 @@
 #!/bin/python3
 import sys
-
-import shutil
-from LatexZettel import files, database 
-import re
 import os
-import peewee as pw
+import re
 import datetime
+import time
+
+from LatexZettel import lazy_import
+
+#the subsystems are imported the first time a command uses them, so that simple commands start quickly
+files = lazy_import('LatexZettel.files')
+database = lazy_import('LatexZettel.database')
+similarity = lazy_import('LatexZettel.similarity')
+search = lazy_import('LatexZettel.search')
+conversion = lazy_import('LatexZettel.conversion')
+wikilinks = lazy_import('LatexZettel.wikilinks')
+transclusion = lazy_import('LatexZettel.transclusion')
+tags = lazy_import('LatexZettel.tags')
+profiling = lazy_import('LatexZettel.profiling')
+scheduler = lazy_import('LatexZettel.scheduler')
+server = lazy_import('LatexZettel.server')
+labels = lazy_import('LatexZettel.labels')
+jobs = lazy_import('LatexZettel.jobs')
+build = lazy_import('LatexZettel.build')
+limits = lazy_import('LatexZettel.limits')
+batch = lazy_import('LatexZettel.batch')
+bibliography = lazy_import('LatexZettel.bibliography')
+pw = lazy_import('peewee')
+shutil = lazy_import('shutil')
+hashlib = lazy_import('hashlib')
+threading = lazy_import('threading')
 
 
-import platform
-
 OPEN_COMMAND = 'xdg-open'
 
-if platform.system() == 'Darwin':
+if sys.platform == 'darwin':
     OPEN_COMMAND = 'open'
-elif platform.system() == 'Windows':
+elif sys.platform == 'win32':
     OPEN_COMMAND = 'start'
 
 class Helper:
@@ -33,7 +53,36 @@ class Helper:
         These can be executed by hand (for now). The plan for the future is to get other applications (eg a text editor) to run these functions.
 
     """
-    renderers = {'pdf': ['pdflatex', ['--interaction=scrollmode']], 'html': ['make4ht', ['-um', 'draft', '-c', os.path.join('..', 'config', 'make4ht.cfg'), '-']]} # {'format': ['command_line_command', ['list', 'of', 'commandline', 'options']]}
+    #commands that ask questions on the terminal or change the working directory, which are run in this process even when a server is running (see Helper.serve)
+    local_commands = ['serve', 'edit', 'rename_recent', 'remove_note', 'force_synchronize', 'sync_md', 'export_project']
+
+    #options that stop the local commands taking them from asking questions, so that they can be run by the server
+    confirm_options = {'sync_md': ['-y', '--yes'], 'export_project': ['-y']}
+
+    #limits on each run of a renderer: seconds of wall time, seconds of CPU time and bytes of memory, see LatexZettel/limits.py
+    render_limits = {'timeout': 300, 'cpu': 300, 'memory': 4 * 1024 ** 3}
+
+    renderers = {'pdf': ['pdflatex', ['--interaction=nonstopmode']], 'html': ['make4ht', ['-um', 'draft', '-c', os.path.join('..', 'config', 'make4ht.cfg'), '-']]} # {'format': ['command_line_command', ['list', 'of', 'commandline', 'options']]}
+
+    def serve(action='start'):
+        """
+
+            Run a server that keeps the database open and answers requests on the Unix socket .texnotes.sock, see LatexZettel/server.py for the protocol.
+            While it is running, `python manage.py function_name ...` forwards the call to the server, except for the commands in Helper.local_commands
+            that need the terminal (unless run with an option in Helper.confirm_options). A command that fails on the server exits with status 1.
+
+            action: start, stop or status
+
+        """
+        if action == 'start':
+            server.serve(Helper)
+        elif action == 'stop':
+            server.call('shutdown')
+        elif action == 'status':
+            try:
+                print(server.call('ping'))
+            except OSError:
+                print('not running')
 
     def help():
         print("""
@@ -250,7 +299,11 @@ class Helper:
             note = database.Note.get(filename=filename)
             print('Delete database entry? (y/n)') 
             if Helper.__getyesno():
-                note.delete_instance()
+                #the tags first, since the link table of older databases doesn't cascade
+                with database.database.atomic():
+                    tags.update_tags(note, set())
+                    search.remove_from_index(note)
+                    note.delete_instance()
         except database.Note.DoesNotExist:
             note = None
             print(f'No note with filename {filename} exists in db')
@@ -284,7 +337,16 @@ class Helper:
                 print('Error, no such file exists')
 
 
-    def sync_md():
+    @profiling.traced('sync_md')
+    def sync_md(*options):
+        """
+            Converts the markdown notes in notes/md to LaTeX notes in notes/slipbox using pandoc. Wikilinks are converted to \\excref and \\exhyperref.
+
+            Options:
+                -y, --yes:  don't ask for confirmation before overwriting files, for running from scripts
+                --force:    convert every file, even if it hasn't changed since the last conversion, or the .tex file is newer than a markdown file it
+                            has never been converted from
+        """
         #check that the database is setup correctly, and that the slipbox folder exists
         database.create_all_tables()
         try:
@@ -295,86 +357,136 @@ class Helper:
 
         markdown_files = files.get_files(os.path.join('notes', 'md'), 'md')
         sb_file_names = {os.path.basename(f)[:-3]: "_".join([s for s in os.path.basename(f).split(" ")])[:-3] for f in markdown_files}
-        print('Warning: this may overwrite any files in notes/slipbox that share their filename with a file in notes/md. Do you wish to continue?')
-        if not Helper.__getyesno():
-            return
-        tracked_note_files = [note.filename for note in database.Note]
+        if '-y' not in options and '--yes' not in options:
+            print('Warning: this may overwrite any files in notes/slipbox that share their filename with a file in notes/md. Do you wish to continue?')
+            if not Helper.__getyesno():
+                return
+        references = {note.filename: note.reference for note in database.Note.select(database.Note.filename, database.Note.reference)}
         for file in markdown_files:
             filename = os.path.basename(file)[:-3]
-            if sb_file_names[filename] not in tracked_note_files:
+            if sb_file_names[filename] not in references:
                 reference_name = ''.join([w.capitalize() for w in sb_file_names[filename].split('_')])
                 note = database.Note(filename=sb_file_names[filename], reference=reference_name, created = datetime.datetime.now(), last_edit_date = datetime.datetime.now())
                 note.save()
                 Helper.addtodocuments(sb_file_names[filename], reference_name)
-        
-        for file in markdown_files:
-            filename = os.path.basename(file)[:-3]
-            sb_file = sb_file_names[filename]
-            print(sb_file)
-            try: 
-                edit_delta = os.path.getmtime(file) - os.path.getmtime(os.path.join('notes', 'slipbox', f'{sb_file}.tex'))
-            except FileNotFoundError:
-                edit_delta = 1
-
-            #if edit_delta > 0:
-            if edit_delta > 0: 
-                #change all the links in the document
-                def md_name_to_reference(m):
-                    filename = m.group(1)
-                    sb_name = '_'.join(filename.split(' '))
-                    return database.Note.get(filename=sb_name).reference
+                references[sb_file_names[filename]] = reference_name
 
+        converted = {c.filename: c.source_hash for c in database.MarkdownConversion}
 
+        def resolve(name):
+            try:
+                return references['_'.join(name.split(' '))]
+            except KeyError:
+                print(f'Warning: link to unknown note {name}')
+                return None
+
+        jobs = []
+        with profiling.span('schedule') as span:
+            for file in markdown_files:
+                filename = os.path.basename(file)[:-3]
+                sb_file = sb_file_names[filename]
                 with open(file, 'r') as f:
-                    file_contents = f.read()
-                regex = r"\[\[([^{\#\]\|}]+)\]\]"
-                text = re.sub(regex, lambda m: f"\\excref{{{md_name_to_reference(m)}}}", file_contents)
+                    text = wikilinks.rewrite(f.read(), resolve)
+
+                source_hash = hashlib.sha1(text.encode()).hexdigest()
+                output = os.path.join('notes', 'slipbox', f'{sb_file}.tex')
+                if '--force' not in options and os.path.exists(output):
+                    if converted.get(sb_file) == source_hash:
+                        continue
+                    #never converted by sync_md (eg before the conversions were recorded), so only overwrite a .tex file older than the markdown
+                    if sb_file not in converted and os.path.getmtime(output) >= os.path.getmtime(file):
+                        continue
+                jobs.append((filename, sb_file, text, source_hash))
+            span['jobs'] = len(jobs)
+
+        #convert in batches, one per worker, so that pandoc startup is only paid once per batch
+        workers = min(os.cpu_count() or 1, len(jobs)) or 1
+        batches = [jobs[i::workers] for i in range(workers)]
+        def convert(batch):
+            return conversion.convert_markdown_batch([(filename, os.path.join('notes', 'slipbox', f'{sb_file}.tex'), text) for filename, sb_file, text, source_hash in batch])
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch, results in zip(batches, pool.map(convert, batches)):
+                for filename, sb_file, text, source_hash in batch:
+                    print(sb_file)
+                    error = results[os.path.join('notes', 'slipbox', f'{sb_file}.tex')]
+                    if error is not None:
+                        print('pandoc error:', error)
+                        continue
+
+                    database.MarkdownConversion.replace(filename=sb_file, source_hash=source_hash).execute()
+
+    @profiling.traced('render')
+    def render(filename, format='pdf', biber=False):
+        """
 
-                regex = r"\[\[([^{\#\]\|}]+)\#\^?([^]]+)\]\]"
+            Render the LaTeX file. By default renders as a pdf and output is stored in the folder /pdf. The other format option is html, although support is currently experimental.
 
-                text = re.sub(regex, lambda m: f"\\excref[{m.group(2)}]{{{md_name_to_reference(m)}}}", text)
+            Each render is recorded in the RenderRun table, see Helper.render_stats
 
+            The renderer runs in a folder of its own under the build root (see LatexZettel/build.py), and only the finished document and the files
+            needed by later renders are moved into the output folder.
 
-                regex = r"\[\[([^{\#\]\|}]+)\|([^]]+)\]\]"
-                text = re.sub(regex, lambda m: f"\\exhyperref{{{md_name_to_reference(m)}}}{{{m.group(2)}}}", text)
+        """
+        database.create_all_tables()
+        try:
+            os.mkdir(format)
+        except FileExistsError:
+            pass
 
-                regex = r"\[\[([^{\#\]\|}]+)\#\^?([^]]+)\|([^]]+)\]\]"
-                text = re.sub(regex, lambda m: f"\\exhyperref[{m.group(2)}]{{{md_name_to_reference(m)}}}{{{m.group(3)}}}", text)
+        note = database.Note.get(filename=filename)
 
+        started = datetime.datetime.now()
+        start = time.perf_counter()
+        passes = 0
 
-                import subprocess 
-                command = 'pandoc' 
-                options = ['-o', os.path.join('notes', 'slipbox', f'{sb_file}.tex')]
-                options += ['-s', '-t', 'latex', '--lua-filter=pandoc/filter.lua', '--template=pandoc/template.tex', '--metadata-file=pandoc/defaults.yaml', "--biblatex",  "-M", f"title={filename}"]
-                process = subprocess.run([command, *options], input=text.encode(), capture_output=True)
+        #notes rendered in a batch (Helper.render_all_batched) have no bbl of their own yet
+        if not biber and not os.path.exists(os.path.join(format, f'{filename}.bbl')) and note.citations.count() > 0:
+            biber = True
 
-                if process.returncode != 0:
-                    print('pandoc error:', process.stderr)
+        with build.job_directory(filename, format) as work:
+            if biber:
+                Helper.__compile(note, format, work)
+                passes += 1
+                Helper.biber(filename, work)
 
-                print(process.stdout)
+            process = Helper.__compile(note, format, work)
+            passes += 1
 
-    def render(filename, format='pdf', biber=False):
-        """
+            if process is None:
+                return process
 
-            Render the LaTeX file. By default renders as a pdf and output is stored in the folder /pdf. The other format option is html, although support is currently experimental.
+            if process.returncode == 0:
+                build.publish(work, filename, format)
 
-        """
+        database.RenderRun.create(note=note, format=format, started=started, duration=time.perf_counter() - start, passes=passes, biber=bool(biber), returncode=process.returncode)
+
+        if process.returncode != 0:
+            print(f'Failed to compile {filename} ({limits.describe(process.returncode)}), see {process.stdout}')
+            return process
+
+
+        if format == 'html':
+            note.last_build_date_html = datetime.datetime.now()
+        elif format == 'pdf':
+            note.last_build_date_pdf = datetime.datetime.now()
+        note.save()
 
+        labels.record(note, format)
         if biber:
-            Helper.render(filename, format, False)
-            Helper.biber(filename)
+            bibliography.clear_pending(note, format)
 
-        import subprocess
+        return process
+
+    def __compile(note, format, cwd=None):
+        """
+            Runs one pass of the renderer on the note, from inside cwd (by default the output folder). Returns the completed process, or None if the note file doesn't exist.
+        """
+        filename = note.filename
         command, options = Helper.renderers[format]
         options = list(options)
 
-        try:
-            os.mkdir(format)
-        except FileExistsError:
-            pass
-
-
-        note = database.Note.get(filename=filename)
         linked_files = set()
 
         external_documents = ""
@@ -405,23 +517,14 @@ class Helper:
         referenced_by_section += "\\end{itemize}"
 
 
-
-        os.chdir(format)
-
-
-        path_to_file = os.path.join('..', 'notes', 'slipbox', f'{filename}.tex') 
-
+        path_to_file = os.path.join('notes', 'slipbox', f'{filename}.tex') 
 
         try:
-            with open(path_to_file, 'r'):
-                pass
+            with open(path_to_file, 'r') as f:
+                contents = f.read()
         except FileNotFoundError:
             print('No such file!')
-            return '', f'Can\'t find {path_to_file}'
-
-
-        with open(path_to_file, 'r') as f:
-            contents = f.read()
+            return None
 
         if format == 'pdf':
             options.insert(0, f"--jobname={filename}")
@@ -443,44 +546,231 @@ class Helper:
 
         document += "\\end{document}"
 
-        process = subprocess.run([command, *options], input=document.encode(), capture_output=True)
-        os.chdir('..')
+        #the aux files of other notes are found in the output folder. The output goes to logs/format/filename.log
+        log = os.path.abspath(os.path.join('logs', format, f'{filename}.log'))
+        return profiling.run([command, *options], runner=limits.run, log=log, input=document.encode(), cwd=cwd or format, env=build.environment(format), **Helper.render_limits)
 
-        if process.returncode != 0:
-            print('Failed to compile', process.stdout.decode()) #TODO: Exceptions
-            return process
 
 
-        if format == 'html':
-            note.last_build_date_html = datetime.datetime.now()
-        elif format == 'pdf':
-            note.last_build_date_pdf = datetime.datetime.now()
-        note.save()
+    def render_all(format='pdf', workers=None, max_attempts=3):
+        """
+            Function to replace renderallhtml and renderallpdf. Renders every note in parallel in two passes: first with biber, then again once every note has an aux file so that the links between notes are resolved. Within each pass the notes that have taken longest to render in the past are started first.
 
-        return process
+            The render jobs are stored in the database, so if the run is interrupted it can be continued with Helper.render_resume. A render that was killed (timed out or out of memory) is retried with an increasing delay, up to max_attempts times.
+        """
+        database.create_all_tables()
+        durations = scheduler.expected_durations(format)
+        notes = scheduler.longest_first(list(database.Note), durations)
+
+        jobs.enqueue(notes, format)
+        Helper.__run_jobs(format, workers, max_attempts)
+
+    def render_all_batched(format='pdf', batch_size=200, workers=None):
+        """
+            Renders every note by combining them into documents of batch_size notes, each compiled three times with a biber run, and splitting the results
+            into a pdf and aux file per note (see LatexZettel/batch.py). Links between notes in the same batch become internal references. Notes that can't be
+            combined (with their own preamble), or whose batch fails to compile, are rendered one at a time afterwards. Only pdf is supported, html is rendered
+            with Helper.render_all. Notes in batches linking to notes rendered one at a time are rendered again if the labels they link to changed.
+            Splitting the batches needs qpdf, without it the notes are all rendered with Helper.render_all.
+        """
+        if format != 'pdf':
+            print('batch rendering only supports pdf, rendering the notes one at a time')
+            return Helper.render_all(format, workers)
+        if shutil.which(batch.SPLIT_COMMAND[0]) is None:
+            print(f'{batch.SPLIT_COMMAND[0]} is needed to split the batches and was not found, rendering the notes one at a time')
+            return Helper.render_all(format, workers)
+
+        database.create_all_tables()
+        try:
+            os.mkdir(format)
+        except FileExistsError:
+            pass
+
+        combined = []
+        single = []
+        for note in database.Note:
+            try:
+                with open(os.path.join('notes', 'slipbox', f'{note.filename}.tex'), 'r') as f:
+                    parts = batch.split_note(f.read())
+            except FileNotFoundError:
+                continue
+            if parts is None:
+                single.append(note)
+            else:
+                combined.append((note, parts))
+        separate = set(note.id for note in single)
 
+        batch_size = int(batch_size)
+        batches = {f'batch-{i // batch_size}': combined[i:i + batch_size] for i in range(0, len(combined), batch_size)}
+        command, options = Helper.renderers[format]
 
+        filenames = {note.reference: note.filename for note in database.Note}
+        with build.job_directory('batch', format) as work:
+            for name, notes in batches.items():
+                document = batch.master_document([(note.reference, title, body, labels.referrers(note)) for note, (title, body) in notes], [n for n in batches if n != name], [(note.reference, note.filename) for note in single], filenames)
+                with open(os.path.join(work, f'{name}.tex'), 'w') as f:
+                    f.write(document)
+
+            def compile(name):
+                log = os.path.abspath(os.path.join('logs', format, f'{name}.log'))
+                return profiling.run([command, *options, f'--jobname={name}', f'{name}.tex'], runner=limits.run, log=log, cwd=work, env=build.environment(format), **Helper.render_limits)
+
+            print(f'rendering {len(combined)} notes in {len(batches)} batches')
+            scheduler.run_parallel(compile, list(batches), workers)
+            scheduler.run_parallel(lambda name: Helper.biber(name, work), list(batches), workers)
+            batch.freeze_aux(batches, work)
+            scheduler.run_parallel(compile, list(batches), workers)
+            batch.freeze_aux(batches, work)
+            processes = scheduler.run_parallel(compile, list(batches), workers)
+
+            for (name, notes), process in zip(batches.items(), processes):
+                if process.returncode != 0:
+                    print(f'{name} failed to compile ({limits.describe(process.returncode)}), its notes will be rendered one at a time')
+                    single.extend(note for note, parts in notes)
+                    continue
+
+                starts, pages, aux = batch.read_aux(os.path.join(work, f'{name}.aux'))
+                ranges = batch.page_ranges(starts, pages)
+                for note, parts in notes:
+                    if note.reference not in ranges:
+                        single.append(note)
+                        continue
+                    first, last = ranges[note.reference]
+                    split = batch.split_pdf(f'{name}.pdf', first, last, f'{note.filename}.pdf', cwd=work)
+                    if split is None or split.returncode != 0:
+                        single.append(note)
+                        continue
+                    with open(os.path.join(work, f'{note.filename}.aux'), 'w') as f:
+                        f.write('\\relax\n' + ''.join(line + '\n' for line in aux.get(note.reference, [])))
+
+                    #the aux file first, as in build.publish
+                    build.publish_file(os.path.join(work, f'{note.filename}.aux'), format)
+                    build.publish_file(os.path.join(work, f'{note.filename}.pdf'), format)
+                    note.last_build_date_pdf = datetime.datetime.now()
+                    note.save()
+                    labels.record(note, format)
+                    bibliography.clear_pending(note, format)
+
+        if len(single) > 0:
+            print(f'rendering {len(single)} notes one at a time')
+            before = {note.id: labels.load(note, format) for note in single}
+            before_referrers = {note.id: labels.load_referrers(note, format) for note in single}
+            jobs.enqueue(single, format)
+            Helper.__run_jobs(format, workers)
+
+            #the batches read the aux files the single notes had before this run, and nothing for the notes of failed batches
+            rerender = set()
+            for note in single:
+                previous = before[note.id] if note.id in separate else {}
+                current = labels.load(note, format)
+                changed = labels.changed(previous, current)
+                #links to a removed label were deleted with it, so the notes that linked to the note are rendered again
+                referrers = before_referrers[note.id] if len(set(previous) - set(current)) > 0 else ()
+                rerender.update(dependent for dependent in labels.dependents(note, changed, referrers) if dependent.id not in before)
+            if len(rerender) > 0:
+                print(f'rendering {len(rerender)} notes linking to notes rendered one at a time again')
+                jobs.enqueue(sorted(rerender, key=lambda note: note.filename), format, passes=(1,))
+                Helper.__run_jobs(format, workers)
+
+    def render_resume(format='pdf', workers=None, max_attempts=3):
+        """
+            Continues the last Helper.render_all of the format from where it stopped, rendering the notes that were being rendered when it was interrupted again and retrying the ones that failed.
+            Every running job is taken to belong to the interrupted run, so don't resume while that run is still going on.
+        """
+        database.create_all_tables()
+        print(f'{jobs.requeue(format, stale=None)} interrupted or failed renders queued again')
+        Helper.__run_jobs(format, workers, max_attempts)
 
-    def render_all(format='pdf'):
+    def __run_jobs(format, workers=None, max_attempts=3, poll=0.5):
         """
-            Function to replace renderallhtml and renderallpdf, rendering notes in a sensible order with regards to dependencies for PDFLaTeX links. Not currently implemented.
+            Renders the queued RenderJobs of the format with a pool of workers, then lists the notes that failed.
         """
-        pass
+        #set on KeyboardInterrupt, so that the workers stop claiming jobs
+        stop = threading.Event()
+
+        def work(worker):
+            while not stop.is_set():
+                job = jobs.claim(format)
+                if job is None:
+                    if jobs.remaining(format) == 0:
+                        return
+                    #waiting for the rest of the pass to finish, or for a retry. Jobs of a process that died are taken over
+                    jobs.requeue(format, failed=False, stale=Helper.__job_timeout())
+                    stop.wait(poll)
+                    continue
+                print(f'rendering {job.note.filename} (pass {job.render_pass})')
+                try:
+                    process = Helper.render(job.note.filename, format, job.render_pass == 1 and job.note.citations.count() > 0)
+                except BaseException:
+                    #otherwise the job stays running and the other workers wait for it
+                    jobs.finish(job, False, retry=False)
+                    raise
+                #a LaTeX error fails the same way every time, only renders that were killed (timed out, out of memory) are retried
+                jobs.finish(job, process is not None and process.returncode == 0, max_attempts, retry=process is not None and process.returncode < 0)
 
+        if workers is None:
+            workers = os.cpu_count() or 1
+        scheduler.run_parallel(work, range(int(workers)), workers, stop=stop)
 
-    def biber(filename, folder='pdf'):
+        Helper.__failure_summary(jobs.failed(format), format)
+
+    def __job_timeout():
+        """
+            Seconds after which a running RenderJob is taken to have been interrupted: longer than a render with biber (three runs) can take.
         """
+        return 3 * (Helper.render_limits.get('timeout') or 1200) + 60
 
-            Run biber on the render of the note. Folder can be either html or pdf, depending on the format.
+    def __failure_summary(notes, format):
+        """
+            Lists the notes that failed to render, with the reason, the first error in the log and where to find the log.
+        """
+        if len(notes) == 0:
+            return
+        print(f'{len(notes)} notes failed to render:')
+        for note in notes:
+            run = database.RenderRun.select().where(database.RenderRun.note == note, database.RenderRun.format == format).order_by(database.RenderRun.started.desc()).first()
+            log = os.path.join('logs', format, f'{note.filename}.log')
+            reason = limits.describe(run.returncode) if run is not None else 'not rendered'
+            print(f'{note.filename}\t{reason}\t{limits.first_error(log) or ""}\t{log}')
 
+    def render_stats(n=10, format='pdf'):
         """
-        import subprocess
-        os.chdir(folder)
-        process = subprocess.run(['biber', filename], capture_output=True)
-        output, error = process.stdout, process.stderr
-        os.chdir('../')
+            Prints the notes that are slowest to render and the notes that fail most often, from the render history.
+        """
+        RenderRun = database.RenderRun
+        database.create_tables(RenderRun)
+        n = int(n)
+
+        durations = scheduler.expected_durations(format)
+        notes = {note.id: note.filename for note in database.Note.select(database.Note.id, database.Note.filename)}
+
+        print(f'Slowest notes ({format}, mean seconds per pass):')
+        for i, (note_id, duration) in enumerate(sorted(durations.items(), key=lambda d: -d[1])[:n]):
+            print(f'{i + 1}:\t{notes.get(note_id)}\t{duration:.2f}')
+
+        failures = (RenderRun
+                    .select(RenderRun.note, pw.fn.SUM(RenderRun.returncode != 0).alias('failures'), pw.fn.COUNT(RenderRun.id).alias('runs'))
+                    .where(RenderRun.format == format)
+                    .group_by(RenderRun.note)
+                    .having(pw.fn.SUM(RenderRun.returncode != 0) > 0)
+                    .order_by(pw.SQL('failures').desc())
+                    .limit(n))
+        print(f'Most frequently failing notes ({format}, failures/renders):')
+        for i, run in enumerate(failures):
+            print(f'{i + 1}:\t{notes.get(run.note_id)}\t{run.failures}/{run.runs}')
+
+
+    @profiling.traced('biber')
+    def biber(filename, folder='pdf'):
+        """
+
+            Run biber on the render of the note. Folder can be either html or pdf, depending on the format, or the build folder of a render in progress.
 
-        return output, error
+            Runs with the same limits as the renderers, and the output goes to logs/biber/filename.log. Returns the completed process.
+
+        """
+        log = os.path.abspath(os.path.join('logs', 'biber', f'{filename}.log'))
+        return profiling.run(['biber', filename], runner=limits.run, log=log, cwd=folder, **Helper.render_limits)
 
 
     def render_all_html():
@@ -496,145 +786,215 @@ class Helper:
         for note in notes:
             filename = os.path.split(note)[-1][:-4]
             print(f'rendering {filename}...', end='')
+            #render runs biber itself for notes citing entries without a bbl, or whose cited entries changed
             process = Helper.render(filename, 'html') 
             print('done')
-            print('running biber...', end='')
-            output, error = Helper.biber(filename, 'html')
-            print('done')
 
         print('render pass 2')
         for note in notes:
             filename = os.path.split(note)[-1][:-4]
             print(f'rendering {filename}...', end='')
             process = Helper.render(filename, 'html')
-            if process.returncode == 0:
+            if process is not None and process.returncode == 0:
                 print('done')
             else:
-                print('\n',process.stderr)
+                print('error!')
 
 
     def render_all_pdf():
         """
-            Renderes all the notes using pdflatex. Saves output in /pdf
+            Renderes all the notes using pdflatex, one at a time. Saves output in /pdf. See Helper.render_all, an interrupted run can be continued with Helper.render_resume
         """
-        import subprocess
+        Helper.render_all('pdf', 1)
 
-        notes = Helper.__getnotefiles()
 
+    def focus(filename=None):
+        """
+            Marks the note as the one being previewed, so that the next render_updates renders it before anything else. Called by editors, without an argument clears the focus.
+            The focus is cleared once the note has been rendered, so an editor that has moved on doesn't keep reordering later renders.
+        """
+        database.set_setting('focus', filename or '')
 
-        print('render pass 1')
-        for note in notes:
-            filename = os.path.split(note)[-1][:-4]
-            print(f'rendering {filename}...', end='')
-            output, error = Helper.render(filename) 
-            if error == b'':
-                print('done')
-                print('running biber...', end='')
-                output, error = Helper.biber(filename)
-                print('done')
-            else:
-                print('error!')
-                print(error)
+    def render_updates(format='pdf', max_renders=3):
+        """
 
-        print('render pass 2')
-        for note in notes:
-            filename = os.path.split(note)[-1][:-4]
-            print(f'rendering {filename}...', end='')
-            output, error = Helper.render(filename)
-            if error == '':
-                print('done')
-            else:
-                print('\n',error)
+            Renders the notes that have changed since they were last rendered, then only the notes affected by the changes: those linking to a label
+            whose number, text or anchor changed (found by comparing the \\newlabel entries of the aux files before and after), and those whose
+            Referenced In section is out of date. A note is rendered at most max_renders times.
 
+            The focused note (see Helper.focus), or otherwise the most recently edited one, is rendered first, then the other edited notes, then
+            the notes depending on them. Before each dependent the modification times of the notes are checked (at most once a second), and if a
+            note was saved in the meantime the slipbox is synchronized again so that it is rendered next. Returns {filename: seconds from saving the note to its render finishing} for the edited notes.
 
-    def render_updates(format='pdf'):
+        """
         updated, new_links, run_biber = Helper.synchronize()
-
-
+        saved = set(note.id for note in updated)
 
         for note in database.Note:
             if note in updated:
                 continue
+            stale = False
             if format == 'pdf':
-                if note.last_build_date_pdf is None or note.last_edit_date > note.last_build_date_pdf:
-                    updated.append(note)
-                    run_biber[note] = True
-                    #fix reference in
-                    new_links.extend([r for r in note.references])
+                stale = note.last_build_date_pdf is None or note.last_edit_date > note.last_build_date_pdf
             elif format == 'html':
-                if note.last_build_date_html is None or note.last_edit_date > note.last_build_date_html:
-                    updated.append(note)
-                    run_biber[note] = True
-                    #fix referenced in
-                    new_links.extend([r for r in note.references])
-
+                stale = note.last_build_date_html is None or note.last_edit_date > note.last_build_date_html
+            if stale:
+                updated.append(note)
+                run_biber[note] = note.citations.count() > 0
+        Helper.__add_pending_biber(updated, run_biber, format)
+
+        queue = scheduler.RenderQueue()
+        Helper.__queue_edited(queue, updated, run_biber)
+        #notes that gained or lost a link render with a new Referenced In section
+        for note in labels.stale_backlinks(format):
+            queue.push(note, queue.DEPENDENT)
+
+        renders = {}
+        latencies = {}
+        failed = []
+
+        mtimes = Helper.__note_mtimes()
+        checked = time.monotonic()
+        while len(queue) > 0:
+            queue.promote(database.get_setting('focus', ''))
+            if queue.peek_priority() == queue.DEPENDENT and time.monotonic() - checked >= 1:
+                #a full synchronize reads every note from the database, so only when a file has changed
+                checked = time.monotonic()
+                current = Helper.__note_mtimes(mtimes)
+                if current != mtimes:
+                    edited, _, biber = Helper.synchronize()
+                    saved.update(note.id for note in edited)
+                    Helper.__add_pending_biber(edited, biber, format)
+                    Helper.__queue_edited(queue, edited, biber)
+                    mtimes = current
+
+            note, priority, biber = queue.pop()
+            if renders.get(note.id, 0) >= max_renders:
+                print(f'{note.filename} has been rendered {max_renders} times, not rendering again')
+                continue
+            renders[note.id] = renders.get(note.id, 0) + 1
 
-        #render the updated files
-        for note in updated:
+            before = labels.load(note, format)
+            before_referrers = labels.load_referrers(note, format)
             print(f'Rendering {note.filename}')
-            Helper.render(note.filename, format, run_biber[note])
-
-
-        rerendered = []
-
-        for link in new_links:
-            if link.target.note in rerendered:
+            process = Helper.render(note.filename, format, biber)
+            if process is None or process.returncode != 0:
+                if note not in failed:
+                    failed.append(note)
                 continue
-            print(f'Rendering {link.target.note.filename}')
-            Helper.render(link.target.note.filename, format)
-            rerendered.append(link.target.note)
+            if note in failed:
+                failed.remove(note)
+            if note.filename == database.get_setting('focus', ''):
+                database.set_setting('focus', '')
+
+            if note.id in saved:
+                saved.remove(note.id)
+                latencies[note.filename] = (datetime.datetime.now() - note.last_edit_date).total_seconds()
+
+            #the note itself is rendered again for its own references, and the notes linking to the changed labels for theirs
+            after = labels.load(note, format)
+            changed = labels.changed(before, after)
+            if len(changed) > 0:
+                queue.push(note, priority)
+                #links to a removed label were deleted with it, so the notes that linked to the note when it was last rendered are rendered again
+                referrers = before_referrers if len(set(before) - set(after)) > 0 else ()
+                for dependent in labels.dependents(note, changed, referrers):
+                    queue.push(dependent, queue.DEPENDENT)
+
+        Helper.__failure_summary(failed, format)
+
+        return latencies
+
+    def __note_mtimes(known=None):
+        """
+            {filename: modification time} of the notes, by default every note in the database, otherwise the filenames in known.
+        """
+        filenames = known if known is not None else [note.filename for note in database.Note.select(database.Note.filename)]
+        mtimes = {}
+        for filename in filenames:
+            try:
+                mtimes[filename] = os.path.getmtime(os.path.join('notes', 'slipbox', f'{filename}.tex'))
+            except FileNotFoundError:
+                pass
+        return mtimes
 
+    def __add_pending_biber(notes, run_biber, format):
+        """
+            Adds the notes citing a changed entry of the bibliography (see LatexZettel/bibliography.py) to notes, to be rendered with biber.
+        """
+        for note in bibliography.pending(format):
+            if note not in notes:
+                notes.append(note)
+            run_biber[note] = True
 
-        #rerender the originals if some other rendering has occured
-        rerendered = []
-        for link in new_links:
-            if link.source in rerendered:
-                continue
-            print(f'rendering {link.source.filename}')
-            Helper.render(link.source.filename, format)
-            rerendered.append(link.source)
+    def __queue_edited(queue, notes, run_biber):
+        """
+            Adds edited notes to the render queue, with the focused or else the most recently edited note first.
+        """
+        if len(notes) == 0:
+            return
+        focus = database.get_setting('focus', '')
+        latest = max(notes, key=lambda note: note.last_edit_date or datetime.datetime.min)
+        if focus not in [note.filename for note in notes]:
+            focus = latest.filename
+        for note in notes:
+            queue.push(note, queue.FOCUSED if note.filename == focus else queue.EDITED, run_biber.get(note, False))
 
 
+    @profiling.traced('synchronize')
     def synchronize():
         """
             Reads all the files that have been changed since the last call of this function and updates the database
         """
-
+        database.create_all_tables()
+        sync_start = datetime.datetime.now().timestamp()
 
         #loop through all the tracked notes and check for required updates
         to_read = []
-        for note in database.Note:
-            #try and get the edit date from the file system. 
-            try:
-                file = os.path.join('notes', 'slipbox', f'{note.filename}.tex')
-                modified = os.path.getmtime(file)
+        with profiling.span('scan') as span:
+            for note in database.Note:
+                #try and get the edit date from the file system. 
+                try:
+                    file = os.path.join('notes', 'slipbox', f'{note.filename}.tex')
+                    modified = os.path.getmtime(file)
 
-                if datetime.datetime.fromtimestamp(modified) > note.last_edit_date:
-                    to_read.append(note)
-                    note.last_edit_date = datetime.datetime.fromtimestamp(modified)
-                    note.save()
+                    if datetime.datetime.fromtimestamp(modified) > note.last_edit_date:
+                        to_read.append(note)
+                        note.last_edit_date = datetime.datetime.fromtimestamp(modified)
+                        note.save()
 
-            except FileNotFoundError:
-                #Todo: file has been deleted or renamed without the database being updated really need to run force_synchronize.
-                print(f'file not found for note with reference {note.reference}')
-                pass
+                except FileNotFoundError:
+                    #Todo: file has been deleted or renamed without the database being updated really need to run force_synchronize.
+                    print(f'file not found for note with reference {note.reference}')
+                    pass
+            span['changed'] = len(to_read)
 
         #update labels 
         run_biber = {}
         for note in to_read:
-            Helper.__update_labels(note)
-            run_biber[note] = Helper.__update_citations(note)
+            with profiling.span('parse', file=note.filename):
+                Helper.__update_labels(note)
+                run_biber[note] = Helper.__update_citations(note)
+                Helper.__update_content(note)
 
 
         new_links = []
-        for note in to_read:
-            new_links.extend(Helper.__update_links(note))
+        with profiling.span('links'):
+            for note in to_read:
+                new_links.extend(Helper.__update_links(note))
+
+        #notes citing entries of bibliography.bib that changed are marked as needing biber, see Helper.render_updates
+        with profiling.span('bibliography'):
+            bibliography.update_index()
 
 
+        database.set_setting('last_synchronize', sync_start)
+
         return to_read, new_links, run_biber
 
 
 
+    @profiling.traced('force_synchronize')
     def force_synchronize():
         """
             Reads the file documents.tex and adds these files to the database (/slipbox.db) and checks for files in /notes that aren't in the documents. Then fixes and confilcts with these before reading the notes and creating database objects for labels, links and citations. 
@@ -725,13 +1085,22 @@ class Helper:
 
         #add labels
         for note in database.Note:
-            Helper.__update_labels(note)
-            Helper.__update_citations(note)
+            with profiling.span('parse', file=note.filename):
+                Helper.__update_labels(note)
+                Helper.__update_citations(note)
+                Helper.__update_content(note)
+        #unused terms don't change the similarities, so they are only deleted here rather than on each synchronize
+        similarity.prune_terms()
+        database.set_setting('tags_scanned', 1)
 
         #add connections
 
-        for note in database.Note: 
-            Helper.__update_links(note)
+        with profiling.span('links'):
+            for note in database.Note: 
+                Helper.__update_links(note)
+
+        with profiling.span('bibliography'):
+            bibliography.update_index()
 
 
 
@@ -753,6 +1122,45 @@ class Helper:
                 print(f'{number}: {note.filename}')
                 number += 1
 
+    def related(filename, n=10):
+        """
+            Prints the n notes with the most similar content to the given note, using the term frequency vectors stored by synchronize.
+        """
+        Helper.synchronize()
+        note = database.Note.get_or_none(filename=filename)
+        if note is None:
+            print(f'no note named {filename}')
+            return
+
+        #notes that have not been read since the vectors were introduced
+        missing = database.Note.select().join(database.NoteVector, pw.JOIN.LEFT_OUTER).where(database.NoteVector.id.is_null())
+        for other in missing:
+            try:
+                similarity.update_vector(other)
+            except FileNotFoundError:
+                pass
+
+        notes = {n.id: n for n in database.Note}
+        for i, (note_id, score) in enumerate(similarity.related(note, n)):
+            print(f'{i + 1}:\t{notes[note_id].filename}\t{score:.3f}')
+
+    def search(*query):
+        """
+            Full text search of the note titles and bodies. Prints the best matches with a snippet of the matching text.
+        """
+        Helper.synchronize()
+
+        #notes that have not been read since the search index was introduced
+        missing = database.Note.select().where(database.Note.id.not_in(database.NoteIndex.select(database.NoteIndex.rowid)))
+        for note in missing:
+            try:
+                search.update_index(note)
+            except FileNotFoundError:
+                pass
+
+        for i, (note, snippet) in enumerate(search.search(' '.join(query))):
+            print(f'{i + 1}:\t{note.filename}\t{snippet}')
+
     def edit(filename=None):
         """
 
@@ -772,103 +1180,200 @@ class Helper:
 
     def to_md(note_name):
         """            
-            Work in progress. Export a LaTeX document note to markdown, and convert references to [[WikiLink]] style references.
+            Work in progress. Export a LaTeX document note to markdown, and convert references to [[WikiLink]] style references. Output is saved in /markdown
+        """
+        os.makedirs('markdown', exist_ok=True)
+        references = {note.reference: note.filename for note in database.Note.select(database.Note.filename, database.Note.reference)}
 
+        with open(f'notes/slipbox/{note_name}.tex', 'r') as f:
+            text = f.read()
+
+        p = conversion.convert_latex(text, os.path.join('markdown', f'{note_name}.md'), references.get)
+
+        if p.returncode != 0:
+            print('pandoc error:', p.stderr.decode())
+
+    def export_md_all(*options):
+        """
+            Export every note to markdown in /markdown, as Helper.to_md. Only notes that have changed since the last export are converted, unless
+            --force is passed. markdown/manifest.json records the source hash and output of each note so that other tools can sync incrementally.
         """
-        def replace_string(m, md_links):
-            replacement = '[['
-            label = ''
-            if m.group(1) is None and m.group(2) == 'c':
-                replacement += md_links[(m.group(5), m.group(4))]
-            elif m.group(1) == 'hyper':
-                replacement += md_links[(m.group(5), m.group(4))] + '|' + m.group(7)
+        import json
+        from concurrent.futures import ThreadPoolExecutor
 
-            print(replacement)
+        os.makedirs('markdown', exist_ok=True)
+        manifest_file = os.path.join('markdown', 'manifest.json')
+        try:
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
 
-            return replacement + ']]'
-        # load the file and convert exhyperref and excref to Wiki links
-        file = []
-        file_references = []
-        with open(f'notes/slipbox/{note_name}.tex', 'r') as f:
-            for line in f:
-                file.append(line)
-                links = re.finditer(r'\\ex?(hyper)?(c)?ref(\[([^]+)\])?\{(.*?)\}', line)
-                for link in links:
-                    if link.group(4) is None:
-                        label = 'note'
-                    else:
-                        label = link.group(4) 
-                    file_references.append((link.group(5), label)) 
+        references = {note.reference: note.filename for note in database.Note.select(database.Note.filename, database.Note.reference)}
 
-        md_links = {} 
-        for ref, tex_label in file_references:
+        jobs = []
+        for filename in references.values():
             try:
-                note = database.Note.get(reference=ref)
-            except database.Note.DoesNotExist:
-                note = None
-
-            if tex_label == 'note':
-                md_links[(ref, tex_label)] = note.filename
-            else:
-                md_links[(ref, tex_label)] = f'{note.filename}#{tex_label}'
-        new_file = bytearray()
-        for line in file:
-            new_file.extend((re.sub(r'\\ex(hyper)?(c)?ref(\[([^]]+)\])?\{(.*?)\}(\{(.*?)\})?', lambda m : replace_string(m, md_links), line)).encode())
+                with open(f'notes/slipbox/{filename}.tex', 'r') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                continue
 
-        import subprocess
+            #links are part of the hash so that renaming a linked note triggers a new export
+            linked = sorted(set(references.get(m.group(2) or m.group(4), '') for m in wikilinks.LATEX_LINK.finditer(text)))
+            source_hash = hashlib.sha1('\n'.join([text] + linked).encode()).hexdigest()
+            output = os.path.join('markdown', f'{filename}.md')
+            if '--force' not in options and manifest.get(filename, {}).get('hash') == source_hash and os.path.exists(output):
+                continue
+            jobs.append((filename, text, output, source_hash))
 
-        print(new_file)
+        def convert(job):
+            filename, text, output, source_hash = job
+            return conversion.convert_latex(text, output, references.get)
 
-        p = subprocess.run(["pandoc", "-t", "markdown", "-f", "latex", "-o", f"markdown/{note_name}.md" ], input=new_file, capture_output=True)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            for (filename, text, output, source_hash), process in zip(jobs, pool.map(convert, jobs)):
+                if process.returncode != 0:
+                    print(f'pandoc error in {filename}:', process.stderr.decode())
+                    continue
+                print(f'exported {filename}')
+                manifest[filename] = {'hash': source_hash, 'output': f'{filename}.md', 'exported': datetime.datetime.now().isoformat()}
+
+        #remove notes that no longer exist
+        for filename in set(manifest) - set(references.values()):
+            print(f'removing {filename}')
+            try:
+                os.remove(os.path.join('markdown', manifest[filename]['output']))
+            except FileNotFoundError:
+                pass
+            del manifest[filename]
 
-        print(p.stdout, p.stderr)
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
 
 
-    def export_project(project_folder, texfile=None):
+    def export_project(project_folder, *options):
         """
 
             Replaces \\transclude calls in a project file with the contents of the notes. Output is saved in project_dir/standalone
 
-        """
+            `python manage.py export_project project_folder [texfile] [-y] [--force]`
 
-        if texfile is None:
-            texfile = f'{project_folder}.tex'
+            The notes transcluded into the project are recorded in the database, and the export is skipped if neither the project file nor any of the transcluded blocks have changed since the last export, unless --force is passed. -y overwrites an existing export without asking. Returns True if the project was exported.
+
+        """
+        texfile = next((o for o in options if not o.startswith('-')), f'{project_folder}.tex')
 
         output_dir = os.path.join('projects', project_folder, 'standalone')
+        input_file = os.path.join('projects', project_folder, texfile)
+        out_file = os.path.join(output_dir, texfile)
+
+        #before the project is recorded, so that a mistyped path doesn't leave a project for update_projects to rebuild
+        if not os.path.exists(input_file):
+            print(f'No such file {input_file}')
+            return False
+
+        database.create_tables(database.Project, database.ProjectDependency)
+        project, created = database.Project.get_or_create(name=project_folder, texfile=texfile)
+
+        with open(input_file, 'rb') as f:
+            source_hash = hashlib.sha1(f.read()).hexdigest()
+
+        engine = transclusion.Transcluder()
+        dependencies = [(d.path, d.tag, d.block_hash) for d in project.dependencies]
+        if '--force' not in options and os.path.exists(out_file) and project.source_hash == source_hash and engine.unchanged(dependencies):
+            print(f'{out_file} is up to date')
+            return False
 
         try:
             os.mkdir(output_dir)
         except FileExistsError:
-            print('Export already exists, continue? (Warning: This will overwrite any changes you have made to the file {texfile} in {output_dir})')
-            if not Helper.__getyesno():
-                return
-
+            if os.path.exists(out_file) and '-y' not in options:
+                print(f'Export already exists, continue? (Warning: This will overwrite any changes you have made to the file {texfile} in {output_dir})')
+                if not Helper.__getyesno():
+                    return False
 
+        try:
+            Helper.__transclude(input_file, out_file, engine=engine)
+        except transclusion.TransclusionError as e:
+            print(f'Could not export {project_folder}/{texfile}: {e}')
+            #forget the source hash so that the next export isn't skipped as up to date
+            project.source_hash = None
+            project.save()
+            return False
+
+        with database.database.atomic():
+            database.ProjectDependency.delete().where(database.ProjectDependency.project == project).execute()
+            rows = [(project.id, path, tag, block_hash) for (path, tag), block_hash in engine.dependencies.items()]
+            fields = [database.ProjectDependency.project, database.ProjectDependency.path, database.ProjectDependency.tag, database.ProjectDependency.block_hash]
+            for i in range(0, len(rows), 200):
+                database.ProjectDependency.insert_many(rows[i:i + 200], fields=fields).execute()
+            project.source_hash = source_hash
+            project.last_export = datetime.datetime.now()
+            project.save()
+
+        print(f'exported {out_file}')
+        return True
+
+    def render_project(project_folder, texfile=None):
+        """
+            Compiles the standalone export of a project with pdflatex and biber. The pdf is saved in project_dir/standalone
+        """
+        import subprocess
+        if texfile is None:
+            texfile = f'{project_folder}.tex'
 
-        output = bytearray()
-        input_file = os.path.join('projects', project_folder, texfile)
+        jobname = texfile[:-4]
+        database.create_tables(database.Project, database.ProjectDependency)
+        try:
+            project = database.Project.get(name=project_folder, texfile=texfile)
+        except database.Project.DoesNotExist:
+            print(f'{project_folder}/{texfile} has not been exported, run `python manage.py export_project {project_folder} {texfile}` first')
+            return None
+        command = ['pdflatex', '--interaction=nonstopmode', '-output-directory=standalone', os.path.join('standalone', texfile)]
+
+        #run from the project folder so that the relative paths in the project file still work
+        cwd = os.path.join('projects', project_folder)
+        log = os.path.abspath(os.path.join('logs', 'projects', project_folder, f'{jobname}.log'))
+        process = profiling.run(command, runner=limits.run, log=log, cwd=cwd, **Helper.render_limits)
+        if process.returncode == 0 and os.path.exists(os.path.join(cwd, 'standalone', f'{jobname}.bcf')):
+            biber_log = os.path.abspath(os.path.join('logs', 'projects', project_folder, f'{jobname}.biber.log'))
+            profiling.run(['biber', os.path.join('standalone', jobname)], runner=limits.run, log=biber_log, cwd=cwd, **Helper.render_limits)
+            process = profiling.run(command, runner=limits.run, log=log, cwd=cwd, **Helper.render_limits)
 
-        with open(input_file, 'r') as f:
-            for line in f:
+        if process.returncode != 0:
+            print(f'Failed to compile {project_folder}/{texfile} ({limits.describe(process.returncode)}), see {log}')
+            return process
 
-                output.extend((re.sub(r'\\transclude(\[[^]]+\]+)?\{([^}]+)\}', '', line).strip() + '\n').encode())
-                external_documents = re.finditer(r'\\transclude(\[([^]]+)\])?\{([^}]+)\}', line)
-                for document in external_documents:
-                    tag = document.group(2)
-                    document = document.group(3)
-                    if tag is None:
-                        tag = 'note'
+        project.last_build_date_pdf = datetime.datetime.now()
+        project.save()
+        return process
 
-                    note_file = os.path.join('notes', 'slipbox', f'{document}.tex')
-                    with open(note_file, 'r') as in_file:
-                        full_document = in_file.read() 
-                        import_text = re.search(f'%<\\*{tag}>((.|\n)*?)%</{tag}>', full_document)
-                        output.extend(import_text.group(1).strip().encode())
+    def update_projects():
+        """
+            Exports and compiles every previously exported project whose transcluded notes have changed. Run by continuous_compile.py
 
-        out_file = os.path.join(output_dir, texfile)
+            A project that fails to export (eg a transclusion cycle) or to compile is left stale, so it is tried again on the next call.
+        """
+        database.create_tables(database.Project, database.ProjectDependency)
+        for project in list(database.Project):
+            if not os.path.exists(os.path.join('projects', project.name, project.texfile)):
+                print(f'Skipping project {project.name}/{project.texfile}: the project file no longer exists')
+                continue
+            try:
+                exported = Helper.export_project(project.name, project.texfile, '-y')
+            except FileNotFoundError as e:
+                print(f'Skipping project {project.name}/{project.texfile}: {e}')
+                continue
 
-        with open(out_file, 'wb') as f:
-            f.write(output)
+            project = database.Project.get_by_id(project.id)
+            if project.source_hash is None:
+                #the export failed, see export_project
+                continue
+            #a failed render leaves last_build_date_pdf older than the export
+            if exported or project.last_build_date_pdf is None or (project.last_export is not None and project.last_build_date_pdf < project.last_export):
+                print(f'Rendering project {project.name}/{project.texfile}')
+                Helper.render_project(project.name, project.texfile)
 
     def export_draft(input_file, output_file=None):
         """
@@ -882,22 +1387,19 @@ class Helper:
             filename = input_file.split('/')[-1]
             output_file = f'draft/{filename}'
 
-        output = bytearray()
+        try:
+            Helper.__transclude(input_file, output_file, metadata=True)
+        except transclusion.TransclusionError as e:
+            print(f'Could not export {input_file}: {e}')
 
+    def __transclude(input_file, output_file, metadata=False, engine=None):
+        if engine is None:
+            engine = transclusion.Transcluder(metadata)
         with open(input_file, 'r') as f:
-            for line in f:
-                output.extend((re.sub(r'\\ExecuteMetaData\[\.\./([^]]+)\]\{([^}]+)\}', '', line).strip() + '\n').encode())
-                external_documents = re.finditer(r'\\ExecuteMetaData\[\.\./([^]]+)\]\{([^}]+)\}', line)
-                for document in external_documents:
-                    import_file = document.group(1) 
-                    tag = document.group(2)
-                    with open(import_file, 'r') as in_file:
-                        import_text_file = in_file.read()
-                        import_text = re.search(f'%<\\*{tag}>((.|\n)*?)%</{tag}>', import_text_file)
-                        output.extend(import_text.group(1).strip().encode())
-
-
-        with open(output_file, 'wb') as f:
+            output = engine.expand(f.read())
+        engine.save()
+
+        with open(output_file, 'w') as f:
             f.write(output)
 
     def remove_duplicate_citations():
@@ -944,6 +1446,15 @@ class Helper:
 
 
 
+    def __update_content(note):
+        with open(f'notes/slipbox/{note.filename}.tex', 'r') as f:
+            text = f.read()
+
+        similarity.update_vector(note, text)
+        search.update_index(note, text)
+        tags.update_tags(note, tags.get_tags(text[-4096:]))
+
+
     def __update_labels(note):
         labels = Helper.__getlabels(note)
         tracked_labels = [label.label for label in note.labels]
@@ -1047,6 +1558,57 @@ class Helper:
         return file_labels
 
 
+    def list_tags():
+        """
+            Lists the tags used in the notes and how many notes have each tag. Tags are the comma separated list on the last line of a note.
+        """
+        Helper.synchronize()
+        Helper.__scan_tags()
+        for tag, count in tags.tag_counts():
+            print(f'{tag}\t{count}')
+
+    def notes_with_tag(tag):
+        """
+            Lists the notes with the given tag.
+        """
+        Helper.synchronize()
+        Helper.__scan_tags()
+        for i, note in enumerate(tags.notes_with_tag(tag)):
+            print(f'{i + 1}:\t{note.filename}')
+
+    def __scan_tags():
+        """
+            Reads the tags of every note once, since synchronize only reads the notes edited after the tags were introduced.
+        """
+        if database.get_setting('tags_scanned') is not None:
+            return
+        for note in database.Note:
+            try:
+                with open(os.path.join('notes', 'slipbox', f'{note.filename}.tex'), 'r') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                continue
+            tags.update_tags(note, tags.get_tags(text[-4096:]))
+        database.set_setting('tags_scanned', 1)
+
+    def notes_citing(key):
+        """
+            Prints the notes citing the entry of bibliography.bib with the given key.
+        """
+        database.create_all_tables()
+        bibliography.update_index()
+        for note in bibliography.notes_citing([key]):
+            print(note.filename)
+
+    def unused_bib_entries():
+        """
+            Prints the keys of the entries of bibliography.bib that aren't cited by any note.
+        """
+        database.create_all_tables()
+        bibliography.update_index()
+        for key in bibliography.unused_entries():
+            print(key)
+
     def list_citations(filename):
         Helper.__getcitations(database.Note.get(filename=filename))
 
@@ -1060,8 +1622,8 @@ class Helper:
             for line in f:
                 citations = re.finditer(r'\\(' + '|'.join(citation_commands) + r')(\[([^]]+)\])?(\{[^\}]+\})?(\[([^]]+)\])?\{([^\}]+)\}', line)
                 for match in citations:
-                    key = match.group(7)
-                    keys.add(key)
+                    #\cite{a,b} cites a and b
+                    keys.update(key.strip() for key in match.group(7).split(',') if key.strip() != '')
 
 
         return keys
@@ -1080,47 +1642,17 @@ class Helper:
                     file_references.append((link.group(5), ref)) 
         return file_references
 
-    def __gettags():
-        notes = Helper.__getnotefiles()
-        tags = {}
-        for note in notes:
-            with open(note) as f:
-                lines = f.read().splitlines()
-                last_line = lines[-1]
-                if re.search(r"\\end\{document\}", last_line) is None:
-                    note_tags = [f.lower() for f in last_line.strip().split(",")]
-                    for tag in note_tags:
-                        tags[tag] = ('notes/'.join(note.split('notes/')[1:]))[:-4]
-
-
-        print(tags)
-
-
-
     def __get_recent_files(n = -1):
-        files = Helper.__getnotefiles()
-
-
-        if int(n) <= 0:
-            n = len(files)
-
-        file_dict = {}
-        for file in files:
-            time = os.path.getmtime(file)
-            if time in file_dict:
-                file_dict[time].append(file)
-            else:
-                file_dict[time] = [file]
-
-        ordered = sorted(file_dict, reverse=True)
-
-
-        r = []
-
-        for i, t in zip(range(n), ordered):
-            r += file_dict[t]
-
-        return r
+        """
+            Paths of the n most recently edited notes (all of them if n <= 0), ranked by the modification times of the files in a single scan of
+            notes/slipbox. The last_edit_date order in the database can't be used: a note saved in place doesn't change the mtime of the folder, so
+            there is no cheap way to tell that the database is out of date.
+        """
+        n = int(n)
+        directory = os.path.join('notes', 'slipbox')
+        if n <= 0:
+            return [path for path, mtime in sorted(files.scan_files(directory, '.tex'), key=lambda f: f[1], reverse=True)]
+        return files.get_recent_files(directory, n, '.tex')
 
 
     def __getyesno():
@@ -1134,24 +1666,55 @@ class Helper:
                 print('Please enter either \'y\' or \'n\'')
 
 
+def commands():
+    """
+        The Helper functions that can be run from the command line, by name. Nothing is imported until the function runs.
+    """
+    return {name: function for name, function in vars(Helper).items() if not name.startswith('_') and callable(function)}
+
+
 def main(args):
     """
 
         Execute the helper functions from the command line.
 
+        Passing --profile (or --profile=trace.json) before the function name records the time spent in each phase, subprocess and database query, and writes them to profile.json in the Chrome trace format.
+
     """
+    profile = None
+    #only before the command name, so that arguments of the command can start with --profile
+    if len(args) > 1 and (args[1] == '--profile' or args[1].startswith('--profile=')):
+        profile = args[1].split('=', 1)[1] if '=' in args[1] else 'profile.json'
+        args = args[:1] + args[2:]
+        profiling.enable()
+
     try:
         func = args[1]
     except IndexError:
         print(f"No argument passed, try '{args[0]} help'")
         return
 
-    try: 
-        function = getattr(Helper, func)
-    except AttributeError:
+    #hand the command to the server if one is running, unless it needs the terminal. The socket is checked for first so that the server module is only imported when there is one
+    forwardable = func not in Helper.local_commands or any(option in args[2:] for option in Helper.confirm_options.get(func, []))
+    if profile is None and forwardable and os.path.exists('.texnotes.sock'):
+        try:
+            if server.forward(func, args[2:]):
+                return
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    function = commands().get(func)
+    if function is None:
         print(f"Unregognised command {args[1]}, try 'help' for a list of availlable commands")
+        return
 
-    function(*args[2:])
+    try:
+        with profiling.span(func, 'command', args=args[2:]):
+            function(*args[2:])
+    finally:
+        if profile is not None:
+            profiling.write_trace(profile)
 
 
 
@@ -4,10 +4,13 @@ import networkx as nx
 import numpy as np
 
 import subprocess
+import threading
+import queue
 
 
-from LatexZettel import analysis
+from LatexZettel import analysis, layout
 import platform
+import sys
 
 #default open commmand for linux
 OPEN_COMMAND = 'xdg-open'
@@ -30,7 +33,7 @@ class App(tk.Tk):
     radius = 2
     circle_color='red'
 
-    def __init__(self, network):
+    def __init__(self, network, relayout=False, engine='force', refine=False, positions=None):
         super().__init__()
         self.title('LaTeX Zettel Network')
         self.canvas = tk.Canvas(self, width=1920, height=1080, bg='white', bd=0, highlightthickness=0)
@@ -52,11 +55,29 @@ class App(tk.Tk):
         self.selected = None
 
         self.network = network
-        #self.positions = nx.nx_agraph.graphviz_layout(self.network)
-        print("calculating positions")
-        #self.positions = nx.spring_layout(self.network, k = 10, iterations=10000, seed=0)
-        self.positions = nx.nx_agraph.graphviz_layout(self.network)
-        print("done")
+        #positions are cached in the database, only calculate the full layout if there are none or it is requested
+        if positions is None:
+            positions = {} if relayout else layout.load_positions()
+        self.positions = {name: p for name, p in positions.items() if name in self.network}
+        self.layout_queue = queue.Queue()
+        self.layout_thread = None
+        self.closing = False
+        if len(self.positions) == 0 and engine == 'graphviz':
+            print("calculating positions")
+            #self.positions = nx.spring_layout(self.network, k = 10, iterations=10000, seed=0)
+            self.positions = nx.nx_agraph.graphviz_layout(self.network)
+            print("done")
+            layout.save_positions(self.positions)
+        elif len(self.positions) == 0 or refine:
+            #draw the starting positions straight away and improve them in the background
+            warm_start = self.positions if refine else None
+            self.positions = layout.force_layout(self.network, positions=warm_start, iterations=0)
+            self.start_layout(warm_start)
+        else:
+            self.positions, new = layout.place_new_nodes(self.network, self.positions)
+            if len(new) > 0:
+                print(f"placed {len(new)} new notes")
+                layout.save_positions({name: self.positions[name] for name in new})
 
 
 
@@ -76,12 +97,17 @@ class App(tk.Tk):
 
         self.scale = 1 
 
+        self.circle_ids = {}
+
         for name in self.network.nodes:
             self.nodes[name] = Node(self.positions[name][0], self.positions[name][1])
 
+        self._calculate_bounds()
+
         for node in self.nodes:
             node_id, text_id = self._add_node_circle(node)
             self.node_ids[node_id] = node 
+            self.circle_ids[node] = node_id
             self.text_ids[node_id] = text_id 
 
             self.node_edges[node_id] = []
@@ -90,8 +116,8 @@ class App(tk.Tk):
 
         for source, dest in self.network.edges:
             edge_id = self._add_edge_line(source, dest)
-            source_id = [node_id for node_id, node in self.node_ids.items() if node == source][0]
-            dest_id = [node_id for node_id, node in self.node_ids.items() if node == dest][0]
+            source_id = self.circle_ids[source]
+            dest_id = self.circle_ids[dest]
             self.edges[edge_id] = (source_id, dest_id)
             
             self.canvas.addtag_withtag('edge', edge_id)
@@ -99,8 +125,77 @@ class App(tk.Tk):
             self.node_edges[source_id].append(edge_id)
             self.node_edges[dest_id].append(edge_id)
 
-        for node in self.node_ids:
-            self.canvas.tag_raise('node')
+        self.canvas.tag_raise('node')
+
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        if self.layout_thread is not None:
+            self.after(100, self.poll_layout)
+
+    def start_layout(self, warm_start=None):
+        """
+            Runs the force directed layout in a background thread, optionally starting from the positions warm_start. Intermediate positions are passed to the main thread through layout_queue.
+        """
+        def callback(positions):
+            self.layout_queue.put(('update', positions))
+            return not self.closing
+
+        def run():
+            positions = layout.force_layout(self.network, positions=warm_start, callback=callback)
+            self.layout_queue.put(('done', positions))
+
+        print("calculating positions")
+        self.layout_thread = threading.Thread(target=run, daemon=True)
+        self.layout_thread.start()
+
+    def poll_layout(self):
+        latest = None
+        done = False
+        while True:
+            try:
+                message, positions = self.layout_queue.get_nowait()
+            except queue.Empty:
+                break
+            latest = positions
+            done = done or message == 'done'
+
+        if latest is not None and self.selected_node is None and not self.dragging_canvas:
+            self.update_positions(latest)
+
+        if done:
+            print("done")
+            layout.save_positions(latest)
+            self.layout_thread = None
+        elif not self.closing:
+            self.after(100, self.poll_layout)
+
+    def update_positions(self, positions):
+        """
+            Moves the nodes and edges on the canvas to new layout positions.
+        """
+        self.positions = positions
+        for name, (x, y) in positions.items():
+            self.nodes[name].x = x
+            self.nodes[name].y = y
+
+        self._calculate_bounds()
+        self.scale = 1
+
+        for name, node_id in self.circle_ids.items():
+            x, y = self.convert_coordinates(self.nodes[name].x, self.nodes[name].y)
+            self.canvas.coords(node_id, x-self.radius, y-self.radius, x+self.radius, y+self.radius)
+            self.canvas.coords(self.text_ids[node_id], x, y + self.radius * 2.5)
+
+        for edge_id, (source_id, dest_id) in self.edges.items():
+            source, dest = self.node_ids[source_id], self.node_ids[dest_id]
+            x0, y0 = self.convert_coordinates(self.nodes[source].x, self.nodes[source].y)
+            x1, y1 = self.convert_coordinates(self.nodes[dest].x, self.nodes[dest].y)
+            if x1 != x0 and y1 != y0:
+                x1, y1 = self._calculate_end_offset(x0, y0, x1, y1)
+            self.canvas.coords(edge_id, x0, y0, x1, y1)
+
+    def close(self):
+        self.closing = True
+        self.destroy()
         
     def resize(self, event):
         self.canvas.config(width=event.width, height=event.height)
@@ -119,7 +214,7 @@ class App(tk.Tk):
         self.canvas.scale('all', event.x, event.y, scale, scale)
 
 
-    def convert_coordinates(self, x, y):
+    def _calculate_bounds(self):
         xs = [n.x for n in self.nodes.values()]
         ys = [n.y for n in self.nodes.values()]
 
@@ -140,6 +235,10 @@ class App(tk.Tk):
         range_x = max_x - min_x
         range_y = max_y - min_y
 
+        self.bounds = (min_x, min_y, max(range_x, 1e-9), max(range_y, 1e-9))
+
+    def convert_coordinates(self, x, y):
+        min_x, min_y, range_x, range_y = self.bounds
         return (x - min_x) / (range_x) * self.width, (y - min_y) / (range_y) * self.height
 
 
@@ -215,13 +314,7 @@ class App(tk.Tk):
             delta = position - self.drag_start_position
             self.drag_start_position = position
 
-            elements = self.canvas.find_all()
-            for element in elements:
-                coords = np.array(self.canvas.coords(element))
-                for i in range(coords.size):
-                    coords[i] += delta[i % 2]
-
-                self.canvas.coords(element, *coords)
+            self.canvas.move('all', *delta)
 
             return 
 
@@ -240,6 +333,7 @@ class App(tk.Tk):
                 dx = edge_coords[2] - edge_coords[0]
                 if dx == 0 or dy == 0:
                     self.canvas.coords(edge, edge_coords[0], edge_coords[1], x, y)
+                    continue
                 x1, y1 = self._calculate_end_offset(*edge_coords[:2], x, y)
                 self.canvas.coords(edge, edge_coords[0], edge_coords[1], x1, y1)
 
@@ -254,5 +348,6 @@ if __name__ == '__main__':
     notes, matrix = analysis.calculate_adjacency_matrix()
     network = nx.DiGraph(matrix)
     network = nx.relabel_nodes(network, {i: note.filename for i, note in enumerate(notes)})
-    App(network).mainloop()
+    engine = 'graphviz' if '--graphviz' in sys.argv else 'force'
+    App(network, relayout='--relayout' in sys.argv, engine=engine, refine='--refine' in sys.argv).mainloop()
 
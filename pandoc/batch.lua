@@ -0,0 +1,49 @@
+-- Converts many markdown notes to LaTeX in a single pandoc process, so that each note doesn't pay for pandoc startup.
+-- Equivalent to running, for each note,
+--
+--   pandoc -o output -s -t latex --lua-filter=pandoc/filter.lua --template=pandoc/template.tex --metadata-file=pandoc/defaults.yaml --biblatex -M title=title
+--
+-- Usage: pandoc lua pandoc/batch.lua < jobs.json, where jobs.json is a list of {"title": ..., "output": ..., "text": ...}.
+-- Prints "ok<TAB>output" or "error<TAB>output<TAB>message" for each job.
+
+local function read_file(path)
+    local f = assert(io.open(path, 'r'))
+    local contents = f:read('a')
+    f:close()
+    return contents
+end
+
+local template = pandoc.template.compile(read_file('pandoc/template.tex'))
+local defaults = pandoc.read('---\n' .. read_file('pandoc/defaults.yaml') .. '\n---\n', 'markdown').meta
+
+local function convert(job)
+    -- the filter keeps its state in local variables, so load a fresh copy for every note
+    local filters = dofile('pandoc/filter.lua')
+    local doc = pandoc.read(job.text, 'markdown')
+
+    for key, value in pairs(defaults) do
+        if doc.meta[key] == nil then
+            doc.meta[key] = value
+        end
+    end
+    doc.meta.title = job.title
+
+    for _, filter in ipairs(filters) do
+        doc = doc:walk(filter)
+    end
+
+    local latex = pandoc.write(doc, 'latex', {template = template, cite_method = 'biblatex'})
+    local f = assert(io.open(job.output, 'w'))
+    f:write(latex)
+    f:close()
+end
+
+local jobs = pandoc.json.decode(io.read('a'), false)
+for _, job in ipairs(jobs) do
+    local ok, message = pcall(convert, job)
+    if ok then
+        io.stdout:write('ok\t' .. job.output .. '\n')
+    else
+        io.stdout:write('error\t' .. job.output .. '\t' .. tostring(message):gsub('%s+', ' ') .. '\n')
+    end
+end
@@ -1,29 +1,25 @@
-import sys, re
+import sys, os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def main(filename):
-    with open(filename, 'r') as f:
-        textfile = f.read()
+from LatexZettel import wikilinks
 
-    #standard links
-    regex = "\[\[([A-Za-z0-9\-\_]+)\]\]"
-    text = re.sub(regex, lambda m: f"\\excref{{{m.group(1)}}}", textfile)
 
-    regex = "\[\[([A-Za-z0-9\-\_]+)\#([A-Za-z0-9\-\_]+)\]\]"
-    text = re.sub(regex, lambda m: f"\\excref[{m.group(2)}]{{{m.group(1)}}}", text)
-    
+def main(input_file='-', output_file='-'):
+    """
+        Converts the wikilinks in input_file to \\excref and \\exhyperref. - (the default) is stdin for the input and stdout for the output, so this can be used in a pipeline, eg
 
-    regex = "\[\[([A-Za-z0-9\-\_]+)\|([^]]+)\]\]"
-    text = re.sub(regex, lambda m: f"\\exhyperref{{{m.group(1)}}}{{{m.group(2)}}}", text)
-    
-    regex = "\[\[([A-Za-z0-9\-\_]+)\#([A-Za-z0-9\-\_]+)\|([^]]+)\]\]"
-    text = re.sub(regex, lambda m: f"\\exhyper[{m.group(2)}]{{{m.group(1)}}}{{{m.group(3)}}}", text)
-     
-    with open('preprocessed.md', 'w') as f:
-        f.write(text)
+        `python pandoc/preprocess.py < note.md | pandoc ...`
+    """
+    infile = sys.stdin if input_file == '-' else open(input_file, 'r')
+    outfile = sys.stdout if output_file == '-' else open(output_file, 'w')
+    try:
+        wikilinks.rewrite_stream(infile, outfile)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
 
 if __name__ == "__main__":
-    try:
-        main(sys.argv[1])
-    except IndexError:
-        print('please pass the filename as a command line argument')
+    main(*sys.argv[1:3])
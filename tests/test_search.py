@@ -0,0 +1,41 @@
+import pytest
+
+from LatexZettel import database, search
+
+
+@pytest.fixture
+def slipbox(tmp_path):
+    database.database.init(str(tmp_path / 'slipbox.db'), pragmas={'foreign_keys': 1})
+    database.create_all_tables()
+    notes = {
+        'cpp': ('C++ templates', 'Templates in C++ are instantiated at compile time.'),
+        'rings': ('Rings', 'A group with a second operation is a ring.'),
+        'quotes': ('Quoting', 'A "quoted" foo bar phrase.'),
+    }
+    for filename, (title, body) in notes.items():
+        note = database.Note.create(filename=filename, reference=filename)
+        search.update_index(note, f'\\title{{{title}}}\n\\begin{{document}}\n{body}\n\\end{{document}}\n')
+    yield
+    database.database.close()
+
+
+def filenames(results):
+    return [note.filename for note, snippet in results]
+
+
+def test_plain_query(slipbox):
+    assert filenames(search.search('ring')) == ['rings']
+
+
+@pytest.mark.parametrize('query', ['C++', 'foo"bar', 'group AND', 'NOT ring', ''])
+def test_invalid_syntax_does_not_raise(slipbox, query):
+    assert isinstance(search.search(query), list)
+
+
+def test_punctuation_is_searched_as_words(slipbox):
+    assert filenames(search.search('C++')) == ['cpp']
+
+
+def test_empty_query_is_invalid(slipbox, capsys):
+    assert search.search('') == []
+    assert 'invalid query' in capsys.readouterr().out